@@ -0,0 +1,97 @@
+"""CarKeywordIndex against the old scan of car_details on a synthetic dataset.
+
+    python benchmarks/bench_car_index.py --cars 100000
+
+The old scan is the substring keyword match generate_answer did before the index: it walked
+the cars in order until five manufacturers matched, so a rare make cost a pass over most of
+the cars. Manufacturers are spelled the way that scan matched them, and both sides must return
+the same cars before they are timed.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bot'))
+
+from car_index import CarKeywordIndex, parse_question
+
+# same keys and caption as bot_utils, which needs the bot config and openai to import
+CAR_ATTRIBUTE_KEYS = {
+    'manufacturer': ['Производитель', 'Manufacturer'],
+    'price': ['Цена', 'Price'],
+    'model': ['Модель', 'Model'],
+    'fuel_type': ['Тип Топлива', 'FuelType'],
+    'office_city_state': ['Город Офиса', 'OfficeCityState']
+}
+OLD_KEYWORDS = {"kia": "kia", "киа": "киа", "hyundai": "hyundai", "цены": "price", "price": "price",
+                "mashina": "car", "машина": "car"}
+# (manufacturer, models, share of the cars), Kia is rare so the scan has to walk far to find five
+MAKES = [('Hyundai', ['Соната', 'Аванте', 'Грандеур'], 99.95), ('Kia', ['К5', 'Карнивал'], 0.05)]
+QUESTIONS = ['hyundai', 'hyundai цены', 'kia', 'kia машина']
+
+
+def get_car_attribute(car, attribute):
+    for key in CAR_ATTRIBUTE_KEYS.get(attribute, []):
+        if key in car:
+            return car[key]
+    return None
+
+
+def make_car_caption(car):
+    return (f"Model: {get_car_attribute(car, 'model')}, Price: {get_car_attribute(car, 'price')}, "
+            f"Fuel Type: {get_car_attribute(car, 'fuel_type')}, "
+            f"Location: {get_car_attribute(car, 'office_city_state')}")
+
+
+def make_cars(count):
+    random.seed(0)
+    cars = {}
+    for i in range(count):
+        manufacturer, models, _ = random.choices(MAKES, weights=[share for _, _, share in MAKES])[0]
+        cars[str(i)] = {'Производитель': manufacturer, 'Модель': random.choice(models),
+                        'Цена': random.randint(500, 9000), 'Тип Топлива': 'Бензин', 'Город Офиса': 'Сеул'}
+    return cars
+
+
+def old_scan(cars, question, limit=5):
+    question_lower = question.lower()
+    relevant_keywords = [value for key, value in OLD_KEYWORDS.items() if key in question_lower]
+    responses = []
+    for car_id, car in cars.items():
+        if any(keyword in get_car_attribute(car, 'manufacturer').lower() for keyword in relevant_keywords):
+            responses.append((car_id, make_car_caption(car)))
+            if len(responses) >= limit:
+                break
+    return responses
+
+
+def per_call(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat * 1e6, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cars', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    cars = make_cars(args.cars)
+    start = time.perf_counter()
+    index = CarKeywordIndex(cars, get_car_attribute, make_car_caption)
+    print(f"index of {args.cars} cars built in {time.perf_counter() - start:.2f}s")
+
+    for question in QUESTIONS:
+        scan_us, scanned = per_call(lambda: old_scan(cars, question), args.repeat)
+        index_us, found = per_call(lambda: index.search(*parse_question(question)[:2]), args.repeat)
+        if scanned != found:
+            raise SystemExit(f"{question!r}: the scan found {scanned} but the index {found}")
+        print(f"{question!r}: scan {scan_us:.0f} us, index {index_us:.1f} us ({len(found)} cars)")
+
+
+if __name__ == '__main__':
+    main()
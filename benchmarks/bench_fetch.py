@@ -0,0 +1,71 @@
+"""Crawl time of CarDataFetcher against the local stub server at several concurrency levels.
+
+    python benchmarks/bench_fetch.py --pages 5 --concurrency 1 8 16
+
+Each page lists 20 cars and every car makes four detail requests, so 5 pages are 405 requests.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_server import serve
+from data.car_data_fetcher import CarDataFetcher
+from data.record_stream import read_records
+
+
+class StubFetcher(CarDataFetcher):
+    """CarDataFetcher pointed at the stub server instead of api.encar.com."""
+
+    def __init__(self, base, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.base = base
+        self.base_url = base + '/search'
+        self.photo_base_url = base
+
+    def get_profile_api_url(self, car_id):
+        return f"{self.base}/profile/{car_id}"
+
+    def get_diagnosis_api_url(self, car_id):
+        return f"{self.base}/diagnosis/{car_id}"
+
+    def get_inspection_api_url(self, car_id):
+        return f"{self.base}/inspection/{car_id}"
+
+    def get_description_api_url(self, car_id):
+        return f"{self.base}/description/{car_id}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 16])
+    parser.add_argument('--delay', type=float, default=0.03, help="seconds the stub takes per request")
+    parser.add_argument('--format', choices=['json', 'ndjson'], default='json')
+    args = parser.parse_args()
+
+    page_size = 20
+    server = serve(total=args.pages * page_size, delay=args.delay)
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for concurrency in args.concurrency:
+            path = os.path.join(tmp_dir, f'cars_{concurrency}.{args.format}')
+            fetcher = StubFetcher(base, '현대', '아반떼', '201800', '202412', args.pages, False, tmp_dir, {}, {},
+                                  concurrency=concurrency, page_size=page_size)
+            start = time.perf_counter()
+            fetcher.fetch_and_save_data(path, None)
+            seconds = time.perf_counter() - start
+            results.append((concurrency, seconds, sum(1 for _ in read_records(path))))
+    server.shutdown()
+
+    for concurrency, seconds, cars in results:
+        print(f"concurrency={concurrency}: {seconds:.2f}s, {cars} cars")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""ModelMatcher against a linear scan of MODEL_MAP.
+
+    python benchmarks/bench_model_matcher.py --lookups 100000
+
+Raw model strings are built from every MODEL_MAP name with the generation and trim
+prefixes/suffixes Encar uses, then looked up in random order as a crawl would.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data.car_data_processor import MODEL_MAP
+from data.model_matcher import ModelMatcher
+
+PREFIXES = ['', '더 뉴 ', '올 뉴 ', '디 올 뉴 ', '뉴 ', '더 뉴 기아 ', '신형 ']
+SUFFIXES = ['', ' IG', ' HG', ' DN8', ' TM', ' MQ4', ' (NX4)', ' 3세대', ' 4세대', ' 하이브리드', ' F/L']
+
+
+def linear_scan(text):
+    """Longest name in text (leftmost on ties), testing every name of MODEL_MAP."""
+    best, best_start, best_len = None, 0, 0
+    for name, value in MODEL_MAP.items():
+        start = text.find(name)
+        if start != -1 and (len(name) > best_len or len(name) == best_len and start < best_start):
+            best, best_start, best_len = value, start, len(name)
+    return best
+
+
+def run(name, match, texts):
+    start = time.perf_counter()
+    for text in texts:
+        match(text)
+    print(f"{name}: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    distinct = [prefix + name + suffix for name in MODEL_MAP for prefix in PREFIXES for suffix in SUFFIXES]
+    texts = [random.choice(distinct) for _ in range(args.lookups)]
+
+    matcher = ModelMatcher(MODEL_MAP)
+    mismatches = [text for text in distinct if matcher.match(text) != linear_scan(text)]
+    if mismatches:
+        raise SystemExit(f"ModelMatcher and the linear scan disagree on {mismatches[:5]}")
+
+    print(f"{args.lookups} lookups of {len(distinct)} distinct raw model strings")
+    run("linear MODEL_MAP scan", linear_scan, texts)
+    cold = ModelMatcher(MODEL_MAP)
+    run("trie, memoization disabled", lambda text: (cold.cache.clear(), cold.match(text)), texts)
+    run("trie with memoization", ModelMatcher(MODEL_MAP).match, texts)
+
+
+if __name__ == '__main__':
+    main()
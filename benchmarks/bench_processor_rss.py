@@ -0,0 +1,89 @@
+"""Peak memory of CarDataProcessor on a synthetic raw file.
+
+    python benchmarks/bench_processor_rss.py --cars 100000 --format json
+
+Writes the raw file to a temporary directory, processes it and prints the time and the peak RSS
+of the process. The input is written first in a child process so it does not count towards the peak.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODELS = ['아반떼', '더 뉴 그랜저', '소나타 뉴 라이즈', '카니발 4세대', 'K5 3세대', '투싼 (NX4)']
+PARTS = ['FRONT_DOOR_LEFT', 'HOOD', 'TRUNK_LID', 'FRONT_FENDER_RIGHT']
+
+
+def make_record(i):
+    return {
+        'main': {'Id': str(i), 'Manufacturer': random.choice(['현대', '기아']), 'Model': random.choice(MODELS),
+                 'Price': float(random.randint(900, 5000)), 'Year': float(random.randint(2018, 2024) * 100 + 1),
+                 'FuelType': random.choice(['가솔린', '디젤', '가솔린+LPG']), 'Mileage': float(random.randint(1, 200000)),
+                 'URL': f'https://fem.encar.com/cars/detail/{i}',
+                 'Photos': [{'location': f'/carpicture/{i}_{k}.jpg'} for k in range(10)]},
+        'profile': {'myAccidentCnt': random.randint(0, 3), 'otherAccidentCnt': random.randint(0, 2),
+                    'myAccidentCost': random.randint(0, 3000000), 'otherAccidentCost': 0},
+        'diagnosis': {'items': [{'name': 'CHECKER_COMMENT', 'result': '양호', 'resultCode': None},
+                                {'name': 'OUTER_PANEL_COMMENT', 'result': '', 'resultCode': None}] +
+                      [{'name': part, 'result': '', 'resultCode': random.choice(['NORMAL', 'NORMAL', 'REPLACEMENT'])}
+                       for part in PARTS]},
+        'inspection': {'inners': [{'type': {'title': '엔진'},
+                                   'children': [{'type': {'title': f'c{k}'}, 'statusType': {'title': '양호'}}
+                                                for k in range(20)]}],
+                       'outers': [{'type': {'title': '후드'}, 'statusTypes': [{'title': '교환'}]}]},
+        'description': {'contents': {'text': '무사고 차량입니다. ' * 20}},
+    }
+
+
+def generate(cars, path):
+    """Writes a raw file like the fetcher does, NDJSON or the legacy pretty-printed JSON dict."""
+    random.seed(0)
+    with open(path, 'w', encoding='utf-8') as file:
+        if path.endswith('.ndjson'):
+            for i in range(cars):
+                file.write(json.dumps({'id': str(i), **make_record(i)}, ensure_ascii=False) + '\n')
+            return
+        file.write('{')
+        for i in range(cars):
+            file.write((',' if i else '') + '\n    ' + json.dumps(str(i)) + ': ' +
+                       json.dumps(make_record(i), ensure_ascii=False, indent=4))
+        file.write('\n}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cars', type=int, default=100000)
+    parser.add_argument('--format', choices=['json', 'ndjson'], default='json')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--generate', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args.cars, args.generate)
+        return
+
+    from data.car_data_processor import CarDataProcessor
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f'raw.{args.format}')
+        subprocess.run([sys.executable, __file__, '--cars', str(args.cars), '--generate', path], check=True)
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        CarDataProcessor(path, workers=args.workers).process_data()
+        seconds = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{args.cars} cars, {size / 1e6:.0f} MB {args.format}: {seconds:.1f}s, peak RSS {peak:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Time for a bot process to load its data, cold and from the pickled snapshots.
+
+    python benchmarks/bench_startup.py --cars 100000
+
+Writes a synthetic car_details.json and processed JSON to a temporary directory and loads them
+twice in fresh processes: the first run parses the JSON, builds the indexes and writes the
+pickles, the second one reads the pickles.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+
+from benchmarks.bench_car_index import get_car_attribute, make_car_caption, make_cars
+
+
+def make_processed(count):
+    random.seed(0)
+    return {str(i): {'Manufacturer': 'KIA', 'Model': random.choice(['K5', 'Carnival']),
+                     'Year': random.randint(2018, 2024), 'Price': random.randint(100, 900) * 100000,
+                     'Mileage': random.randint(0, 200000), 'FuelType': 'Бензин',
+                     'URL': f'http://fem.encar.com/cars/detail/{i}', 'myAccidentCnt': i % 3, 'otherAccidentCnt': 0,
+                     'myAccidentCost': 0, 'otherAccidentCost': 0, 'diagnosis': 'Официальная диагностика.',
+                     'replacement_parts': []}
+            for i in range(count)}
+
+
+def load(data_dir):
+    """What the bots do at startup, in this process."""
+    from car_index import CarKeywordIndex
+    from car_store import CarStore
+    from snapshot_cache import dataset_version, load_cached
+
+    details_path = os.path.join(data_dir, 'car_details.json')
+    processed_path = os.path.join(data_dir, 'processed.json')
+
+    def build():
+        with open(details_path, 'r', encoding='utf-8') as file:
+            cars = json.load(file)
+        return cars, CarKeywordIndex(cars, get_car_attribute, make_car_caption)
+
+    start = time.perf_counter()
+    load_cached(details_path, build)
+    details_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    CarStore(processed_path).load(dataset_version(processed_path))
+    print(f"car_details + keyword index {details_seconds:.2f}s, "
+          f"processed JSON -> CarSnapshot {time.perf_counter() - start:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cars', type=int, default=100000)
+    parser.add_argument('--load', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load:
+        load(args.load)
+        return
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        for name, cars in (('car_details.json', make_cars(args.cars)), ('processed.json', make_processed(args.cars))):
+            with open(os.path.join(data_dir, name), 'w', encoding='utf-8') as file:
+                json.dump(cars, file, ensure_ascii=False)
+
+        for run in ('cold', 'from pickle'):
+            result = subprocess.run([sys.executable, __file__, '--load', data_dir],
+                                    capture_output=True, text=True, check=True)
+            print(f"{run}: {result.stdout.strip().splitlines()[-1]}")
+
+
+if __name__ == '__main__':
+    main()
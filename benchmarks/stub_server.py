@@ -0,0 +1,66 @@
+"""Local stand-in for the Encar search and detail APIs, used by the fetch benchmarks.
+
+Every request sleeps `delay` seconds like a remote round trip. Search pages list `total`
+cars; search offsets in `fail_offsets` answer 404 to exercise a failing page. Detail
+responses carry an ETag and answer 304 to a matching If-None-Match.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        url = urlparse(self.path)
+        if url.path.startswith('/search'):
+            self.search(url)
+        else:
+            self.detail(url)
+
+    def search(self, url):
+        _, _, offset, size = parse_qs(url.query).get('sr', ['|PriceAsc|0|20'])[0].split('|')
+        offset, size = int(offset), int(size)
+        if offset in self.server.fail_offsets:
+            self.send_body(404)
+            return
+        cars = [{'Id': str(100000 + i), 'Manufacturer': '현대', 'Model': '아반떼', 'Price': 1000 + i,
+                 'Year': 202001.0, 'FuelType': '가솔린', 'Mileage': 1000,
+                 'Photos': [{'location': f'/carpicture/{i}_{k}.jpg'} for k in range(3)]}
+                for i in range(offset, min(offset + size, self.server.total))]
+        self.send_body(200, json.dumps({'Count': self.server.total, 'SearchResults': cars}).encode('utf-8'))
+
+    def detail(self, url):
+        etag = f'"{abs(hash(url.path))}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_body(304, headers={'ETag': etag})
+            return
+        self.send_body(200, json.dumps({'path': url.path, 'items': []}).encode('utf-8'), {'ETag': etag})
+
+
+def serve(total=400, delay=0.03, fail_offsets=(), port=0):
+    """Starts the stub on a daemon thread, returns the server, its url is http://127.0.0.1:<server_port>."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.total = total
+    server.delay = delay
+    server.fail_offsets = set(fail_offsets)
+    threading.Thread(target=server.serve_forever, name='stub-server', daemon=True).start()
+    return server
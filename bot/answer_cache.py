@@ -0,0 +1,123 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+TOKEN_RE = re.compile(r'\w+')
+# words that do not change what is asked
+FILLER_WORDS = {'пожалуйста', 'подскажите', 'скажите', 'please', 'а', 'ну', 'вот', 'же', 'ли'}
+
+
+def normalize_question(question):
+    """'Какая  растаможка?!' and 'какая растаможка' share one key."""
+    tokens = TOKEN_RE.findall(question.lower().replace('ё', 'е'))
+    return ' '.join(token for token in tokens if token not in FILLER_WORDS)
+
+
+class AnswerCache:
+    """Bounded LRU + TTL cache of answers keyed by the normalized question.
+
+    With a path, answers are also kept in SQLite, so they survive restarts and entries
+    evicted from memory are still found on disk until they expire. Concurrent misses for
+    the same key wait for a single upstream call.
+    """
+
+    def __init__(self, max_size=1000, ttl=7 * 24 * 3600, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> (answer, expires_at), least recently used first
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0, 'upstream_seconds': 0.0}
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, answer TEXT, expires_at REAL)')
+            self.db.execute('DELETE FROM answers WHERE expires_at < ?', (time.time(),))
+            self.db.commit()
+
+    def lookup(self, key):
+        """Returns the cached answer or None. Called with the lock held."""
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[0]
+            del self.entries[key]
+
+        if self.db is not None:
+            row = self.db.execute('SELECT answer, expires_at FROM answers WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[1] > now:
+                self.remember(key, row[0], row[1])
+                self.stats['disk_hits'] += 1
+                return row[0]
+        return None
+
+    def remember(self, key, answer, expires_at):
+        self.entries[key] = (answer, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def put(self, key, answer):
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self.remember(key, answer, expires_at)
+            if self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO answers VALUES (?, ?, ?)', (key, answer, expires_at))
+                self.db.commit()
+
+    def get_or_compute(self, question, compute):
+        """Returns the answer to question, calling compute(question) once per key on a miss.
+
+        Errors raised by compute are not cached and are re-raised to every waiting caller.
+        """
+        key = normalize_question(question)
+        if not key:
+            return compute(question)
+        with self.lock:
+            answer = self.lookup(key)
+            if answer is not None:
+                return answer
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = Future()
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not owner:
+            return future.result()
+
+        start = time.perf_counter()
+        try:
+            answer = compute(question)
+        except Exception as e:
+            with self.lock:
+                self.stats['errors'] += 1
+                del self.pending[key]
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.stats['upstream_seconds'] += time.perf_counter() - start
+
+        self.put(key, answer)
+        with self.lock:
+            del self.pending[key]
+        future.set_result(answer)
+        return answer
+
+    def print_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        print(f"answer cache: {stats['hits']} hits, {stats['disk_hits']} disk hits, {stats['misses']} misses, "
+              f"{stats['coalesced']} coalesced, {stats['errors']} errors, "
+              f"{stats['upstream_seconds'] / max(stats['misses'], 1):.2f}s per upstream call")
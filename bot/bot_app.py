@@ -1,7 +1,18 @@
-from flask import Flask
+import os
+import sys
+from flask import Flask, Response
+# common/ at the repo root holds the modules shared with the data pipeline
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from bot_config import Config
+from common import metrics
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    metrics.registry.enabled = Config.METRICS_ENABLED
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return Response(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
     return app
\ No newline at end of file
@@ -1,3 +1,20 @@
 class Config:
     TELEGRAM_BOT_TOKEN = "your_telegram_bot_token"
-    OPENAI_API_KEY = "your_openai_api_key"
\ No newline at end of file
+    OPENAI_API_KEY = "your_openai_api_key"
+    # threads answering webhook updates after they have been acknowledged
+    WEBHOOK_WORKERS = 8
+    PHOTO_BASE_URL = "https://raw.githubusercontent.com/argenaden/car-pricing-korea/main/car_photos"
+    # resized variant made by data/image_variants.py, e.g. "thumb", sent instead of the original photo;
+    # only set it once the variants are published under PHOTO_BASE_URL
+    PHOTO_VARIANT = None
+    # OpenAI answers are reused for the same normalized question, on disk too when a path is set
+    ANSWER_CACHE_SIZE = 1000
+    ANSWER_CACHE_TTL = 7 * 24 * 3600
+    ANSWER_CACHE_PATH = None
+    # SQLite database written by main.py --listing_db, replaces data/car_details.json when set
+    LISTING_DB_PATH = None
+    # Telegram file_ids of the photos sent so far, so each photo is uploaded from PHOTO_BASE_URL once;
+    # kept in memory unless a SQLite path is set, e.g. "bot/data/file_ids.db", which warm_up() opens
+    FILE_ID_CACHE_PATH = None
+    # handler, OpenAI and Telegram latencies on /metrics, which otherwise only shows the cache and queue stats
+    METRICS_ENABLED = False
@@ -1,21 +1,33 @@
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from flask import request, Response
-from bot_utils import generate_answer, message_parser, send_message_telegram, send_photo_telegram
+from common import metrics
+from bot_utils import handle_incoming_message, warm_up
+
+
+def handle_update(msg):
+    try:
+        with metrics.timer('bot_handler_seconds', bot='webhook', handler='message'):
+            handle_incoming_message(msg)
+    except Exception:
+        metrics.inc('bot_handler_errors_total', bot='webhook', handler='message')
+        # the update is already acknowledged, so log instead of failing the request
+        traceback.print_exc()
+
 
 def init_routes(app):
+    # answers are generated and sent in the background, the webhook only acknowledges the update
+    workers = ThreadPoolExecutor(max_workers=app.config.get('WEBHOOK_WORKERS', 8))
+    # the cars load in the background while the app already acknowledges updates
+    warm_up()
+
     @app.route('/webhook', methods=['POST'])
     def webhook():
         msg = request.get_json()
-        chat_id, incoming_question = message_parser(msg)
-        answer = generate_answer(incoming_question)
-
-        if isinstance(answer, list):
-            for photo_url, caption in answer:
-                send_photo_telegram(chat_id, photo_url, caption)
-        else:
-            send_message_telegram(chat_id, answer)
-
+        if msg and 'message' in msg:
+            workers.submit(handle_update, msg)
         return Response('OK', status=200)
 
     @app.route('/', methods=['GET'])
     def index():
-        return "<h1>Telegram Bot Webhook Endpoint</h1>"
+        return "<h1>Telegram Bot Webhook Endpoint</h1>"
\ No newline at end of file
@@ -1,9 +1,11 @@
 import os
+import sys
 import argparse
-import json
+import functools
 import logging
 from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     ContextTypes,
@@ -13,6 +15,12 @@ from telegram.ext import (
     filters,
 )
 from telegram.constants import ParseMode
+# common/ at the repo root holds the modules shared with the data pipeline
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from car_store import CarStore
+from listing_db import ListingStore
+from search_sessions import SearchSession, SessionStore
+from common import metrics
 
 
 # Enable logging
@@ -24,6 +32,9 @@ logger = logging.getLogger(__name__)
 TELEGRAM_BOT_API_KEY = os.environ["TELEGRAM_BOT_API_KEY"]
 YEAR_RANGE_START = 2018
 YEAR_RANGE_END = 2024
+# search sessions kept in memory, idle ones are dropped after SESSION_IDLE_TIMEOUT seconds
+MAX_SESSIONS = 10000
+SESSION_IDLE_TIMEOUT = 3600
 
 # Define conversation states
 MANUFACTURER, MODEL, START_YEAR, END_YEAR, RETURN_RESULTS = range(5)
@@ -37,6 +48,14 @@ CAR_DICT = {
 }
 
 
+def timed(handler):
+    """Records the latency of a conversation handler, replies included."""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        with metrics.timer('bot_handler_seconds', bot='telegram', handler=handler.__name__):
+            return await handler(update, context)
+    return wrapper
+
 # Start the conversation
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the conversation and asks the user about the manufacturer."""
@@ -136,6 +155,10 @@ async def end_year_selection(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text(f"Пожалуйста, выберите год в диапазоне от {start_year} до {YEAR_RANGE_END}.")
         return END_YEAR
 
+    if not context.bot_data['car_store'].ready():
+        await update.message.reply_text("Бот загружает базу автомобилей, выберите год ещё раз через несколько секунд.")
+        return END_YEAR
+
     context.user_data['end_year'] = int(end_year)
     mnfctr = context.user_data['manufacturer']
     model = context.user_data['model']
@@ -144,7 +167,11 @@ async def end_year_selection(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     await update.message.reply_text(f"Вы выбрали {mnfctr} {model} с {start_year} по {end_year} года выпуска.")
 
-    context, answer_msg = search_results(context)
+    # the matches are selected once, the following answers only move the session cursor
+    car_database = context.bot_data['car_store'].snapshot()
+    session = SearchSession(car_database, car_database.select(mnfctr, model, start_year, end_year))
+    context.bot_data['sessions'].start(update.effective_chat.id, session)
+    answer_msg = search_results(session)
 
     reply_keyboard = [['Смотреть подробнее'], ['Смотреть следующий вариант'], ['Завершить']]
     await update.message.reply_text(answer_msg, parse_mode=ParseMode.MARKDOWN_V2, 
@@ -156,25 +183,31 @@ async def end_year_selection(update: Update, context: ContextTypes.DEFAULT_TYPE)
 # Return the results according to the user's selection
 async def return_results(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_reply = update.message.text
+    sessions = context.bot_data['sessions']
+    session = sessions.get(update.effective_chat.id)
     if user_reply == 'Завершить':
+        sessions.end(update.effective_chat.id)
         await update.message.reply_text(
             "Спасибо за использование нашего бота! Если хотите попробовать ещё раз, нажмите /start.",
             reply_markup=ReplyKeyboardRemove()
         )
         return ConversationHandler.END
-    elif user_reply == 'Смотреть подробнее':
-        full_answer_msg = get_full_answer_msg(context)
+    elif session is None:
+        await update.message.reply_text(
+            "Поиск устарел. Нажмите /start, чтобы начать новый поиск.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        return ConversationHandler.END
+    elif user_reply == 'Смотреть подробнее' and session.current() is not None:
+        full_answer_msg = get_full_answer_msg(session)
         reply_keyboard = [['Смотреть следующий вариант'], ['Завершить']]
-        print(full_answer_msg)
         # temporary solution
         await update.message.reply_text(full_answer_msg, parse_mode=ParseMode.MARKDOWN_V2,
                                             reply_markup=ReplyKeyboardMarkup(
                                                 reply_keyboard, one_time_keyboard=True, resize_keyboard=True))
         return RETURN_RESULTS
     
-    print(context.bot_data['iter_idx'])
-    print(context.bot_data['answer_id'])
-    context, answer_msg = search_results(context)
+    answer_msg = search_results(session)
 
     reply_keyboard = [['Смотреть подробнее'], ['Смотреть следующий вариант'], ['Завершить']]
     await update.message.reply_text(answer_msg, parse_mode=ParseMode.MARKDOWN_V2, 
@@ -183,49 +216,27 @@ async def return_results(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     return RETURN_RESULTS
 
-# Search the results based on the user's selection
-def search_results(context: ContextTypes.DEFAULT_TYPE) -> int:
-    mnfctr = context.user_data['manufacturer']
-    model = context.user_data['model']
-    start_year = context.user_data['start_year']
-    end_year = context.user_data['end_year']
+# Show the next car of the chat's search session
+def search_results(session: SearchSession) -> str:
+    short_msg = session.next_short()
+    if short_msg is None:
+        return "Больше вариантов нет\\. Нажмите /start, чтобы начать новый поиск\\."
 
-    # Retrieve data_path from the application context
-    data_path = context.bot_data['data_path']
-    with open(data_path, 'r') as file:
-        car_database = json.load(file)
-    car_database_list = list(car_database.values())
-    
-    answer_id = context.bot_data['answer_id'] + 1
-    curr_iter_idx = context.bot_data['iter_idx'] + 1
-    for i, car_info in enumerate(car_database_list[curr_iter_idx:]):
-        if mnfctr == car_info['Manufacturer'] and model in car_info['Model']:
-            year = int(str(car_info['Year'])[:4])
-            if start_year <= year <= end_year:
-                answer_msg = f'__*Вариант №{answer_id}\n*__'
-                answer_msg += car_info['short_answer_msg']
-                context.bot_data['answer_id'] = answer_id
-                context.bot_data['iter_idx'] = curr_iter_idx + i
-                return context, answer_msg
+    return f'__*Вариант №{session.cursor + 1}\n*__' + short_msg
 
 # Get the full answer message
-def get_full_answer_msg(context: ContextTypes.DEFAULT_TYPE) -> str:
-    data_path = context.bot_data['data_path']
-    with open(data_path, 'r') as file:
-        car_database = json.load(file)
-    car_database_list = list(car_database.values())
-
-    answer_id = context.bot_data['answer_id']
-    curr_iter_idx = context.bot_data['iter_idx']
-    answer_msg = f'__*Вариант №{answer_id}\n*__'
-    answer_msg += car_database_list[curr_iter_idx]['full_answer_msg']
-    return answer_msg
+def get_full_answer_msg(session: SearchSession) -> str:
+    full_msg = session.snapshot.messages.full(session.current())
+    if full_msg is None:
+        return "Это объявление уже снято с продажи\\. Посмотрите следующий вариант\\."
+    return f'__*Вариант №{session.cursor + 1}\n*__' + full_msg
 
 # Cancel the conversation
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancels and ends the conversation."""
     user = update.message.from_user
     logger.info(f"User {user.first_name} canceled the conversation.")
+    context.bot_data['sessions'].end(update.effective_chat.id)
 
     await update.message.reply_text(
         "Спасибо за использование нашего бота! Если хотите попробовать ещё раз, нажмите /start.",
@@ -234,29 +245,40 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
 
 # Main function to start the bot
-def main(data_path) -> None:
+def main(data_path, metrics_port=None) -> None:
     """Run the bot."""
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(TELEGRAM_BOT_API_KEY).build()
+    # replies wait for Telegram's global and per-chat flood limits and are retried after a 429
+    application = Application.builder().token(TELEGRAM_BOT_API_KEY).rate_limiter(AIORateLimiter(max_retries=3)).build()
 
     # Store data_path in application context
-    if not os.path.isfile(data_path) or not data_path.endswith('.json'):
-        raise ValueError("Invalid data path. Please provide a valid JSON file.")
+    if not os.path.isfile(data_path) or not data_path.endswith(('.json', '.db')):
+        raise ValueError("Invalid data path. Please provide a valid JSON file or listing database.")
     application.bot_data['data_path'] = data_path
-    application.bot_data['answer_id'] = 0
-    application.bot_data['iter_idx'] = -1
+    # a listing database is queried per search, a JSON file is loaded into memory
+    application.bot_data['car_store'] = ListingStore(data_path) if data_path.endswith('.db') else CarStore(data_path)
+    application.bot_data['car_store'].warm_up()
+    application.bot_data['sessions'] = SessionStore(MAX_SESSIONS, SESSION_IDLE_TIMEOUT)
+
+    if metrics_port:
+        metrics.registry.enabled = True
+        metrics.registry.add_collector(lambda: [
+            ('search_sessions', {}, len(application.bot_data['sessions'])),
+            ('car_data_loaded', {}, int(application.bot_data['car_store'].ready())),
+        ])
+        metrics.serve(metrics_port)
 
     # Add conversation handler with the states
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
+        entry_points=[CommandHandler("start", timed(start))],
         states={
-            MANUFACTURER: [MessageHandler(filters.TEXT, manufacturer)],
-            MODEL: [MessageHandler(filters.TEXT, model)],
-            START_YEAR: [MessageHandler(filters.TEXT, start_year_selection)],
-            END_YEAR: [MessageHandler(filters.TEXT, end_year_selection)],
-            RETURN_RESULTS: [MessageHandler(filters.TEXT, return_results)],
+            MANUFACTURER: [MessageHandler(filters.TEXT, timed(manufacturer))],
+            MODEL: [MessageHandler(filters.TEXT, timed(model))],
+            START_YEAR: [MessageHandler(filters.TEXT, timed(start_year_selection))],
+            END_YEAR: [MessageHandler(filters.TEXT, timed(end_year_selection))],
+            RETURN_RESULTS: [MessageHandler(filters.TEXT, timed(return_results))],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", timed(cancel))],
     )
 
     # Add the handler to the application
@@ -267,10 +289,11 @@ def main(data_path) -> None:
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Run the Telegram bot.")
-    parser.add_argument("--data_path", type=str, default="data", help="Path car database")
+    parser.add_argument("--data_path", type=str, default="data", help="Path car database (.json or .db listing database)")
+    parser.add_argument("--metrics_port", type=int, default=None, help="Record handler latencies and serve them on /metrics")
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = parse_args()
-    main(args.data_path)
+    main(args.data_path, args.metrics_port)
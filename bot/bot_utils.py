@@ -1,86 +1,177 @@
 import requests
 import openai
 import json
+import logging
 import os
+import sqlite3
+from common import metrics
+from requests.adapters import HTTPAdapter
+from answer_cache import AnswerCache
 from bot_config import Config
+from car_index import CarKeywordIndex, parse_question
+from file_id_cache import FileIdCache
+from telegram_dispatcher import TelegramDispatcher, TelegramError
+from listing_db import ListingReader
+from snapshot_cache import BackgroundLoader, dataset_version, load_cached, read_verified
+
+logger = logging.getLogger(__name__)
 
 openai.api_key = Config.OPENAI_API_KEY
 telegram_bot_token = Config.TELEGRAM_BOT_TOKEN
 
+# shared by all webhook workers, keeps the connections to api.telegram.org open
+http = requests.Session()
+http.mount('https://', HTTPAdapter(pool_maxsize=Config.WEBHOOK_WORKERS))
+# every reply goes through one rate limited queue
+dispatcher = TelegramDispatcher(http, telegram_bot_token, workers=Config.WEBHOOK_WORKERS)
 
-def load_car_details():
-    json_file_path = os.path.join(os.path.dirname(__file__), 'data', 'car_details.json')
-    with open(json_file_path, 'r') as file:
-        return json.load(file)
-
-
-car_details = load_car_details()
 
-keywords = {
-    "kia": "kia",
-    "киа": "киа",
-    "hyundai": "hyundai",
-    "цены": "price",
-    "price": "price",
-    "mashina": "car",
-    "машина": "car"
+CAR_ATTRIBUTE_KEYS = {
+    'manufacturer': ['Производитель', 'Manufacturer'],
+    'price': ['Цена', 'Price'],
+    'model': ['Модель', 'Model'],
+    'fuel_type': ['Тип Топлива', 'FuelType'],
+    'office_city_state': ['Город Офиса', 'OfficeCityState']
 }
 
 
 def get_car_attribute(car, attribute):
-    keys_map = {
-        'manufacturer': ['Производитель', 'Manufacturer'],
-        'price': ['Цена', 'Price'],
-        'model': ['Модель', 'Model'],
-        'fuel_type': ['Тип Топлива', 'FuelType'],
-        'office_city_state': ['Город Офиса', 'OfficeCityState']
-    }
-    for key in keys_map.get(attribute, []):
+    for key in CAR_ATTRIBUTE_KEYS.get(attribute, []):
         if key in car:
             return car[key]
     return None
 
 
+def make_car_caption(car):
+    model = get_car_attribute(car, 'model') or "Model not specified"
+    price = get_car_attribute(car, 'price') or "Price not available"
+    fuel_type = get_car_attribute(car, 'fuel_type') or "Fuel type not specified"
+    office_city_state = get_car_attribute(car, 'office_city_state') or "Office location not specified"
+    return f"Model: {model}, Price: {price}, Fuel Type: {fuel_type}, Location: {office_city_state}"
+
+
+CAR_DETAILS_PATH = os.path.join(os.path.dirname(__file__), 'data', 'car_details.json')
+
+
+def load_car_details(version):
+    def build():
+        cars = json.loads(read_verified(CAR_DETAILS_PATH))
+        # built once, so a question only walks the posting lists of the names it mentions
+        return cars, CarKeywordIndex(cars, get_car_attribute, make_car_caption)
+
+    # restarts unpickle the cars and their index instead of parsing the JSON again
+    cars, index = load_cached(CAR_DETAILS_PATH, build)
+    file_id_cache.evict_missing(cars)
+    return cars, index
+
+
+def load_listing_db(version):
+    listing_db = ListingReader(Config.LISTING_DB_PATH)
+    file_id_cache.evict_missing(listing_db.car_ids())
+    return listing_db
+
+
+answer_cache = AnswerCache(Config.ANSWER_CACHE_SIZE, Config.ANSWER_CACHE_TTL, Config.ANSWER_CACHE_PATH)
+# in memory until warm_up() opens the configured database, nothing is created at import
+file_id_cache = FileIdCache()
+# the cars are loaded in the background by warm_up(), questions get a warming up reply until then;
+# a newly published car_details.json is loaded the same way while the old one keeps answering.
+# With a listing database questions are answered by indexed queries instead of a file in memory
+if Config.LISTING_DB_PATH:
+    car_data = BackgroundLoader(load_listing_db, 'car data')
+else:
+    car_data = BackgroundLoader(load_car_details, 'car data', version=lambda: dataset_version(CAR_DETAILS_PATH))
+
+
+def open_file_id_cache():
+    global file_id_cache
+    if not Config.FILE_ID_CACHE_PATH or file_id_cache.db is not None:
+        return
+    try:
+        file_id_cache = FileIdCache(Config.FILE_ID_CACHE_PATH)
+    except sqlite3.Error as e:
+        # photos are still sent, by URL until Telegram returns their file_ids again
+        print(f"Could not open the file_id cache {Config.FILE_ID_CACHE_PATH}: {e}")
+
+
+def warm_up():
+    # opened first, the car data loader evicts the file_ids of unlisted cars from it
+    open_file_id_cache()
+    car_data.start()
+
+
+def collect_metrics():
+    # the stats the caches and the dispatcher keep anyway, read when /metrics is scraped
+    for name, value in answer_cache.stats.items():
+        yield f'answer_cache_{name}_total', {}, value
+    yield 'file_id_cache_entries', {}, len(file_id_cache)
+    for name in ('queued', 'sent', 'api_calls', 'coalesced', 'rate_limited', 'failed'):
+        yield f'telegram_{name}_total', {}, dispatcher.stats[name]
+    with dispatcher.lock:
+        depth = dispatcher.depth()
+    yield 'telegram_queue_depth', {}, depth
+    yield 'car_data_loaded', {}, int(car_data.loaded is not None)
+
+
+metrics.registry.add_collector(collect_metrics)
+
+
+# the photo of a car shown in answers
+PHOTO_INDEX = 2
+# file_ids are kept per variant, as Telegram ingests every variant as a different photo
+FILE_ID_VARIANT = Config.PHOTO_VARIANT or 'original'
+
+
+def get_photo_url(car_id, index=PHOTO_INDEX, variant=Config.PHOTO_VARIANT):
+    if variant:
+        return f"{Config.PHOTO_BASE_URL}/{car_id}/{index}_{variant}.jpg"
+    return f"{Config.PHOTO_BASE_URL}/{car_id}/{index}.jpg"
+
+
+def ask_openai(question):
+    context = "У меня вопрос про автомобили в Корее"
+    with metrics.timer('openai_request_seconds'):
+        response = openai.completions.create(
+            model="gpt-3.5-turbo-instruct",
+            prompt=f"{context}\nQ: {question}\nA:",
+            max_tokens=1024,
+            temperature=0.7
+        )
+    return response.choices[0].text.strip()
+
+
+def search_cars(manufacturers, models, limit=5):
+    """Returns (car id, caption) pairs, or None while the cars are still loading."""
+    loaded = car_data.get()
+    if loaded is None:
+        return None
+    if Config.LISTING_DB_PATH:
+        return [(car_id, make_car_caption(car))
+                for car_id, car in loaded.search(sorted(manufacturers), sorted(models), limit)]
+    _, car_index = loaded
+    return car_index.search(manufacturers, models, limit)
+
+
 def generate_answer(question):
     if question is None:
         return "Sorry, I can only respond to text messages."
 
-    print(f"Processing question: {question}")  # Debug output
-    question_lower = question.lower()
-    relevant_keywords = [value for key, value in keywords.items() if key in question_lower]
-    print(f"Relevant keywords: {relevant_keywords}")  # Debug output
-
-    if relevant_keywords:
-        responses = []
-
-        for car_id, car in car_details.items():
-            manufacturer = get_car_attribute(car, 'manufacturer')
-            if any(keyword in manufacturer.lower() for keyword in relevant_keywords):
-                model = get_car_attribute(car, 'model') or "Model not specified"
-                price = get_car_attribute(car, 'price') or "Price not available"
-                fuel_type = get_car_attribute(car, 'fuel_type') or "Fuel type not specified"
-                office_city_state = get_car_attribute(car, 'office_city_state') or "Office location not specified"
-                car_info = f"Model: {model}, Price: {price}, Fuel Type: {fuel_type}, Location: {office_city_state}"
-                photo_url = f"https://raw.githubusercontent.com/argenaden/car-pricing-korea/main/car_photos/{car_id}/2.jpg"
-                responses.append((photo_url, car_info))
-                print(f"Generated car info: {car_info}")
-
-                if len(responses) >= 5:
-                    break
+    manufacturers, models, generic = parse_question(question)
+    logger.debug(f"Question {question!r}: keywords {sorted(manufacturers | models)}, generic: {generic}")
 
+    if manufacturers or models:
+        metrics.inc('bot_questions_total', kind='cars')
+        responses = search_cars(manufacturers, models, limit=5)
+        if responses is None:
+            return "I'm warming up, please try again in a few seconds."
         return responses
 
     else:
+        metrics.inc('bot_questions_total', kind='openai')
         try:
-            context = "У меня вопрос про автомобили в Корее"
-            response = openai.completions.create(
-                model="gpt-3.5-turbo-instruct",
-                prompt=f"{context}\nQ: {question}\nA:",
-                max_tokens=1024,
-                temperature=0.7
-            )
-            return response.choices[0].text.strip()
+            return answer_cache.get_or_compute(question, ask_openai)
         except Exception as e:
+            metrics.inc('openai_errors_total')
             print(f"Error calling OpenAI API: {str(e)}")  # Error handling
             return "There was an error processing your request. Please try again."
 
@@ -92,19 +183,60 @@ def message_parser(message):
 
 
 def send_message_telegram(chat_id, text):
-    url = f'https://api.telegram.org/bot{telegram_bot_token}/sendMessage'
-    payload = {'chat_id': chat_id, 'text': text}
-    return requests.post(url, json=payload)
+    return dispatcher.send_message(chat_id, text)
 
 
 def send_photo_telegram(chat_id, photo_url, caption):
-    url = f'https://api.telegram.org/bot{telegram_bot_token}/sendPhoto'
-    payload = {
-        'chat_id': chat_id,
-        'photo': photo_url,
-        'caption': caption
-    }
-    return requests.post(url, json=payload)
+    return dispatcher.send_photos(chat_id, [(photo_url, caption)])[0]
+
+
+def send_media_group_telegram(chat_id, photos):
+    # the dispatcher merges the photos into sendMediaGroup calls of up to 10
+    return dispatcher.send_photos(chat_id, photos)
+
+
+def remember_file_ids(car_ids, messages):
+    for car_id, sent in zip(car_ids, messages):
+        sizes = sent.get('photo') if sent else None
+        if sizes:
+            file_id_cache.put(car_id, PHOTO_INDEX, FILE_ID_VARIANT, sizes[-1]['file_id'])
+
+
+def send_car_photo_telegram(chat_id, car_id, caption, file_id):
+    """Sends one car by file_id, then by URL, and as a text message when Telegram takes none of them."""
+    if file_id:
+        try:
+            return send_photo_telegram(chat_id, file_id, caption).result()
+        except TelegramError:
+            # a file_id Telegram no longer accepts
+            file_id_cache.discard(car_id, PHOTO_INDEX, FILE_ID_VARIANT)
+    urls = [get_photo_url(car_id)]
+    if Config.PHOTO_VARIANT:
+        # the variant of this car may not be published, the original photo is
+        urls.append(get_photo_url(car_id, variant=None))
+    for url in urls:
+        try:
+            return send_photo_telegram(chat_id, url, caption).result()
+        except TelegramError:
+            pass
+    send_message_telegram(chat_id, caption).result()
+    return None
+
+
+def send_car_photos_telegram(chat_id, cars):
+    """Sends (car id, caption) pairs as an album, by file_id when Telegram already has the photo."""
+    car_ids = [car_id for car_id, _ in cars]
+    file_ids = [file_id_cache.get(car_id, PHOTO_INDEX, FILE_ID_VARIANT) for car_id in car_ids]
+    photos = [(file_id or get_photo_url(car_id), caption) for (car_id, caption), file_id in zip(cars, file_ids)]
+    try:
+        messages = [future.result() for future in send_media_group_telegram(chat_id, photos)]
+    except TelegramError as e:
+        # one bad photo fails the whole album, so every car is sent on its own instead
+        print(f"Album to {chat_id} failed ({e}), sending the cars one by one")
+        messages = [send_car_photo_telegram(chat_id, car_id, caption, file_id)
+                    for (car_id, caption), file_id in zip(cars, file_ids)]
+    remember_file_ids(car_ids, messages)
+    return messages
 
 
 def handle_incoming_message(message):
@@ -113,8 +245,10 @@ def handle_incoming_message(message):
         responses = generate_answer(incoming_question)
 
         if isinstance(responses, list):
-            for photo_url, caption in responses:
-                send_photo_telegram(chat_id, photo_url, caption)
+            if responses:
+                send_car_photos_telegram(chat_id, responses)
+            else:
+                send_message_telegram(chat_id, "Sorry, I couldn't find any cars matching your question.")
         else:
             send_message_telegram(chat_id, responses)
     else:
@@ -0,0 +1,135 @@
+import heapq
+import re
+from itertools import islice
+
+# canonical name -> aliases in Latin, Cyrillic and Hangul (all normalized)
+MANUFACTURER_ALIASES = {
+    'hyundai': ['hyundai', 'хендай', 'хендэ', 'хундай', 'хёндай', 'хюндай', '현대'],
+    'kia': ['kia', 'киа', '기아'],
+    'genesis': ['genesis', 'генезис', '제네시스'],
+    'chevrolet': ['chevrolet', 'chevy', 'шевроле', '쉐보레'],
+}
+MODEL_ALIASES = {
+    'grandeur': ['grandeur', 'грандеур', 'грандж', '그랜저'],
+    'avante': ['avante', 'elantra', 'аванте', 'элантра', '아반떼'],
+    'sonata': ['sonata', 'соната', '소나타', '쏘나타'],
+    'santa fe': ['santa fe', 'santafe', 'санта фе', 'сантафе', '산타페', '싼타페'],
+    'starex': ['starex', 'старекс', '스타렉스'],
+    'tucson': ['tucson', 'туссан', 'тусан', '투싼'],
+    'carnival': ['carnival', 'карнивал', '카니발'],
+    'k5': ['k5', 'к5'],
+    'k7': ['k7', 'к7'],
+    'sorento': ['sorento', 'соренто', '쏘렌토'],
+    'ray': ['ray', 'рей', '레이'],
+    'morning': ['morning', 'морнинг', '모닝'],
+    'eq900': ['eq900'],
+    'g70': ['g70'],
+    'g80': ['g80'],
+    'g90': ['g90'],
+    'gv70': ['gv70'],
+    'gv80': ['gv80'],
+    'gv90': ['gv90'],
+    'spark': ['spark', 'спарк', '스파크'],
+    'malibu': ['malibu', 'малибу', '말리부'],
+    'trax': ['trax', 'тракс', '트랙스'],
+    'cruze': ['cruze', 'круз', '크루즈'],
+    'orlando': ['orlando', 'орландо', '올란도'],
+    'trailblazer': ['trailblazer', 'трейлблейзер', '트레일블레이저'],
+}
+# model aliases that are also everyday English words or places, e.g. "ray of light",
+# they only count in a question that also names a manufacturer or asks for prices
+AMBIGUOUS_MODEL_ALIASES = ['grandeur', 'sonata', 'santa fe', 'tucson', 'carnival', 'ray', 'morning',
+                           'spark', 'malibu', 'orlando']
+# words asking about listings, on their own they are a question for OpenAI, e.g. about customs
+GENERIC_KEYWORDS = ['цены', 'price', 'mashina', 'машина']
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    return ' '.join(TOKEN_RE.findall(str(text).lower().replace('ё', 'е')))
+
+
+def iter_terms(text):
+    """Yields the single words and word pairs of a normalized text, e.g. for 'santa fe'."""
+    tokens = normalize(text).split()
+    yield from tokens
+    for first, second in zip(tokens, tokens[1:]):
+        yield f'{first} {second}'
+
+
+def build_alias_map(aliases):
+    return {normalize(alias): name for name, names in aliases.items() for alias in names}
+
+
+MANUFACTURER_MAP = build_alias_map(MANUFACTURER_ALIASES)
+MODEL_MAP = build_alias_map(MODEL_ALIASES)
+GENERIC_SET = set(GENERIC_KEYWORDS)
+AMBIGUOUS_SET = {normalize(alias) for alias in AMBIGUOUS_MODEL_ALIASES}
+
+
+def parse_question(question):
+    """Returns the manufacturers, models and whether a generic listing keyword was asked for.
+
+    Only a question naming a manufacturer or model is answered with listings."""
+    manufacturers, models, generic = set(), set(), False
+    ambiguous = set()
+    for term in iter_terms(question):
+        if term in AMBIGUOUS_SET:
+            ambiguous.add(MODEL_MAP[term])
+        elif term in MODEL_MAP:
+            models.add(MODEL_MAP[term])
+        elif term in MANUFACTURER_MAP:
+            manufacturers.add(MANUFACTURER_MAP[term])
+        elif term in GENERIC_SET:
+            generic = True
+    if manufacturers or generic:
+        models |= ambiguous
+    return manufacturers, models, generic
+
+
+class CarKeywordIndex:
+    """Inverted index from manufacturer/model names to cars, with captions rendered up front.
+
+    Posting lists hold positions in dataset order, so a query walks only as many entries
+    as results it returns.
+    """
+
+    def __init__(self, cars, get_attribute, make_caption):
+        self.car_ids = []
+        self.captions = []
+        self.manufacturers = {}
+        self.models = {}
+        for car_id, car in cars.items():
+            pos = len(self.car_ids)
+            self.car_ids.append(car_id)
+            self.captions.append(make_caption(car))
+
+            manufacturer = self.lookup(get_attribute(car, 'manufacturer'), MANUFACTURER_MAP)
+            if manufacturer is not None:
+                self.manufacturers.setdefault(manufacturer, []).append(pos)
+            model = self.lookup(get_attribute(car, 'model'), MODEL_MAP)
+            if model is not None:
+                self.models.setdefault(model, []).append(pos)
+
+    @staticmethod
+    def lookup(value, alias_map):
+        if value is None:
+            return None
+        for term in iter_terms(value):
+            if term in alias_map:
+                return alias_map[term]
+        return None
+
+    def search(self, manufacturers=(), models=(), limit=5):
+        """Returns up to limit (car id, caption) pairs of the given models, else manufacturers,
+        else of any car, in dataset order."""
+        if models:
+            postings = [self.models.get(model, []) for model in models]
+        elif manufacturers:
+            postings = [self.manufacturers.get(manufacturer, []) for manufacturer in manufacturers]
+        else:
+            postings = [range(len(self.car_ids))]
+
+        positions = postings[0] if len(postings) == 1 else heapq.merge(*postings)
+        return [(self.car_ids[pos], self.captions[pos]) for pos in islice(positions, limit)]
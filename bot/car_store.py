@@ -0,0 +1,96 @@
+import bisect
+import json
+import logging
+from common.message_render import TEMPLATE_VERSION, MessageCache
+from snapshot_cache import BackgroundLoader, dataset_version, load_cached, read_verified
+from price_analytics import PriceAnalytics
+
+logger = logging.getLogger(__name__)
+
+
+def parse_year(year) -> int:
+    # processed data keeps the year as 2018, raw data as 201803.0
+    return int(str(year)[:4])
+
+
+class CarSnapshot:
+    """Immutable, indexed view of a processed car database."""
+
+    def __init__(self, cars, version):
+        self.cars = cars
+        self.version = version
+        self.postings = self.build_postings(cars)
+        # fitted once per dataset version, so replies only do a lookup
+        self.analytics = PriceAnalytics(cars)
+        self.messages = MessageCache(cars, self.analytics)
+
+    @staticmethod
+    def build_postings(cars):
+        # (Manufacturer, Model) -> (sorted years, car ids in the same order)
+        entries = {}
+        for pos, (car_id, car_info) in enumerate(cars.items()):
+            key = (car_info['Manufacturer'], car_info['Model'])
+            year = parse_year(car_info['Year'])
+            entries.setdefault(key, []).append((year, car_info['Price'], pos, car_id))
+
+        postings = {}
+        for key, key_entries in entries.items():
+            key_entries.sort()
+            years = [entry[0] for entry in key_entries]
+            car_ids = [entry[3] for entry in key_entries]
+            postings[key] = (years, car_ids)
+        return postings
+
+    def __len__(self):
+        return len(self.cars)
+
+    def get(self, car_id):
+        return self.cars.get(car_id)
+
+    def year_range(self, mnfctr, model, start_year, end_year):
+        """Returns the car ids of the posting list and the [lo, hi) slice matching the years."""
+        years, car_ids = self.postings.get((mnfctr, model), ([], []))
+        lo = bisect.bisect_left(years, start_year)
+        hi = bisect.bisect_right(years, end_year)
+        return car_ids, lo, hi
+
+    def count(self, mnfctr, model, start_year, end_year) -> int:
+        _, lo, hi = self.year_range(mnfctr, model, start_year, end_year)
+        return hi - lo
+
+    def select(self, mnfctr, model, start_year, end_year):
+        """Returns the ids of the matching cars, cheapest first within a year."""
+        car_ids, lo, hi = self.year_range(mnfctr, model, start_year, end_year)
+        return car_ids[lo:hi]
+
+
+class CarStore:
+    """Serves the current snapshot of the car database and swaps in a new one, loaded in the
+    background, when a new version of the file is published."""
+
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self.loader = BackgroundLoader(self.load, f"cars of {data_path}",
+                                       version=lambda: dataset_version(data_path))
+
+    def load(self, version):
+        def build():
+            car_database = json.loads(read_verified(self.data_path))
+            return CarSnapshot(car_database, version)
+
+        # restarts unpickle the indexed snapshot instead of parsing and indexing the JSON again
+        snapshot = load_cached(self.data_path, build, version=TEMPLATE_VERSION)
+        logger.info(f"Loaded {len(snapshot)} cars from {self.data_path}.")
+        return snapshot
+
+    def warm_up(self):
+        # loads the first snapshot in the background so the bot starts polling at once
+        self.loader.start()
+
+    def ready(self) -> bool:
+        return self.loader.loaded is not None
+
+    def snapshot(self) -> CarSnapshot:
+        """Returns the current snapshot without waiting for a newer one being loaded,
+        None before the first one is loaded."""
+        return self.loader.get()
@@ -0,0 +1,58 @@
+import sqlite3
+import threading
+
+
+class FileIdCache:
+    """Telegram file_id of every photo sent so far, keyed by (car id, photo index, variant).
+
+    Once Telegram has ingested a photo from its URL the returned file_id is sent instead,
+    which needs no download by Telegram. Kept in SQLite when a path is given.
+    """
+
+    def __init__(self, path=None):
+        self.lock = threading.Lock()
+        self.file_ids = {}
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS file_ids (car_id TEXT, photo_index INTEGER, variant TEXT, '
+                            'file_id TEXT, PRIMARY KEY (car_id, photo_index, variant))')
+            self.db.commit()
+            for car_id, index, variant, file_id in self.db.execute('SELECT * FROM file_ids'):
+                self.file_ids[(car_id, index, variant)] = file_id
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def get(self, car_id, index, variant):
+        return self.file_ids.get((str(car_id), index, variant))
+
+    def put(self, car_id, index, variant, file_id):
+        key = (str(car_id), index, variant)
+        with self.lock:
+            if self.file_ids.get(key) == file_id:
+                return
+            self.file_ids[key] = file_id
+            if self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO file_ids VALUES (?, ?, ?, ?)', (*key, file_id))
+                self.db.commit()
+
+    def discard(self, car_id, index, variant):
+        key = (str(car_id), index, variant)
+        with self.lock:
+            self.file_ids.pop(key, None)
+            if self.db is not None:
+                self.db.execute('DELETE FROM file_ids WHERE car_id = ? AND photo_index = ? AND variant = ?', key)
+                self.db.commit()
+
+    def evict_missing(self, car_ids):
+        """Drops the file_ids of cars no longer in the dataset, returns how many were dropped."""
+        car_ids = {str(car_id) for car_id in car_ids}
+        with self.lock:
+            stale = [key for key in self.file_ids if key[0] not in car_ids]
+            for key in stale:
+                del self.file_ids[key]
+            if self.db is not None and stale:
+                self.db.executemany('DELETE FROM file_ids WHERE car_id = ? AND photo_index = ? AND variant = ?', stale)
+                self.db.commit()
+        return len(stale)
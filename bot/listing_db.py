@@ -0,0 +1,127 @@
+import json
+import logging
+import sqlite3
+import threading
+from common.message_render import TEMPLATE_VERSION, render_market_msg, render_messages
+from price_analytics import PriceAnalytics
+from snapshot_cache import BackgroundLoader
+
+logger = logging.getLogger(__name__)
+
+
+class ListingReader:
+    """Read-only access to the listing database written by data/listing_db.py.
+
+    Every thread gets its own connection, WAL mode lets any number of bot processes
+    read while the processor writes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    @property
+    def db(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+        return db
+
+    def version(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def get(self, car_id):
+        row = self.db.execute('SELECT data FROM listings WHERE id = ?', (car_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def car_ids(self):
+        return [car_id for car_id, in self.db.execute('SELECT id FROM listings')]
+
+    def select(self, mnfctr, model, start_year, end_year, limit=-1, offset=0):
+        """Returns the ids of the matching cars, cheapest first within a year."""
+        rows = self.db.execute(
+            'SELECT id FROM listings WHERE manufacturer = ? AND model = ? AND year BETWEEN ? AND ? '
+            'ORDER BY year, price, rowid LIMIT ? OFFSET ?',
+            (mnfctr, model, start_year, end_year, limit, offset))
+        return [car_id for car_id, in rows]
+
+    def search(self, manufacturers=(), models=(), limit=5, offset=0):
+        """Returns up to limit (car id, car info) pairs of the given models, else manufacturers,
+        else of any car, in the order they were written."""
+        column, names = ('model', models) if models else ('manufacturer', manufacturers)
+        where = f"WHERE {column} IN ({', '.join('?' * len(names))})" if names else ''
+        rows = self.db.execute(f'SELECT id, data FROM listings {where} ORDER BY rowid LIMIT ? OFFSET ?',
+                               (*names, limit, offset))
+        return [(car_id, json.loads(data)) for car_id, data in rows]
+
+    def load_analytics(self):
+        rows = self.db.execute('SELECT id, manufacturer, model, year, price, mileage, my_accident_cnt FROM listings')
+        return PriceAnalytics({car_id: {'Manufacturer': mnfctr, 'Model': model, 'Year': year, 'Price': price,
+                                        'Mileage': mileage, 'myAccidentCnt': accidents}
+                               for car_id, mnfctr, model, year, price, mileage, accidents in rows})
+
+
+class ListingMessages:
+    """MessageCache counterpart reading the messages stored by the processor."""
+
+    def __init__(self, reader, analytics):
+        self.reader = reader
+        self.analytics = analytics
+
+    def render(self, car_id, full):
+        """Returns the message of a car, None when a newer crawl has deleted it since it was selected."""
+        car_info = self.reader.get(car_id)
+        if car_info is None:
+            return None
+        if car_info.get('template_version') == TEMPLATE_VERSION:
+            msg = car_info['full_answer_msg' if full else 'short_answer_msg']
+        else:
+            msg = render_messages(car_info)[1 if full else 0]
+        return msg + render_market_msg(self.analytics.market_delta(car_id))
+
+    def short(self, car_id):
+        return self.render(car_id, full=False)
+
+    def full(self, car_id):
+        return self.render(car_id, full=True)
+
+
+class ListingSnapshot:
+    """CarSnapshot counterpart on top of the listing database: cars are read by id and
+    only the price analytics are kept in memory."""
+
+    def __init__(self, reader, version):
+        self.reader = reader
+        self.version = version
+        self.analytics = reader.load_analytics()
+        self.messages = ListingMessages(reader, self.analytics)
+
+    def get(self, car_id):
+        return self.reader.get(car_id)
+
+    def select(self, mnfctr, model, start_year, end_year):
+        return self.reader.select(mnfctr, model, start_year, end_year)
+
+
+class ListingStore:
+    """CarStore counterpart for a listing database, a new snapshot is made in the background
+    when the processor has committed new listings."""
+
+    def __init__(self, path):
+        self.reader = ListingReader(path)
+        self.loader = BackgroundLoader(self.load, f"listings of {path}", version=self.reader.version)
+
+    def load(self, version):
+        snapshot = ListingSnapshot(self.reader, version)
+        logger.info(f"Loaded price analytics of {len(snapshot.analytics.car_index)} cars from {self.reader.path}.")
+        return snapshot
+
+    def snapshot(self) -> ListingSnapshot:
+        return self.loader.get()
+
+    def warm_up(self):
+        self.loader.start()
+
+    def ready(self) -> bool:
+        return self.loader.loaded is not None
@@ -0,0 +1,116 @@
+import numpy as np
+
+PERCENTILES = (10, 25, 50, 75, 90)
+# below this many cars a group has no fair price, so its cars get no market estimate
+MIN_REGRESSION_SIZE = 5
+
+
+class PriceAnalytics:
+    """Market price statistics per (Manufacturer, Model, Year), fitted in one batch.
+
+    Inside every group the price is regressed on mileage and accident history,
+    price ~ a + b * mileage + c * had_accident, which gives a fair price for every car
+    and an accident discount for the group. All groups are fitted at once with NumPy,
+    so an instance is built once per dataset version and lookups are O(1).
+    """
+
+    def __init__(self, cars):
+        self.car_index = {}
+        group_index = {}
+        group_ids, prices, mileages, accidents = [], [], [], []
+        for car_id, car_info in cars.items():
+            key = (car_info['Manufacturer'], car_info['Model'], int(str(car_info['Year'])[:4]))
+            self.car_index[car_id] = len(prices)
+            group_ids.append(group_index.setdefault(key, len(group_index)))
+            prices.append(car_info['Price'])
+            mileages.append(car_info['Mileage'])
+            accidents.append(1.0 if car_info.get('myAccidentCnt', 0) > 0 else 0.0)
+
+        self.group_index = group_index
+        self.fit(np.array(group_ids, dtype=np.int64), np.array(prices, dtype=np.float64),
+                 np.array(mileages, dtype=np.float64), np.array(accidents, dtype=np.float64))
+
+    def fit(self, groups, prices, mileages, accidents):
+        n_groups = len(self.group_index)
+        counts = np.bincount(groups, minlength=n_groups)
+        self.counts = counts
+        if not len(prices):
+            self.percentiles = np.zeros((0, len(PERCENTILES)))
+            self.fair_prices = self.deltas = self.accident_discounts = self.mileage_slopes = np.zeros(0)
+            self.has_estimate = np.zeros(0, dtype=bool)
+            return
+
+        # percentiles with linear interpolation on the prices sorted inside each group
+        order = np.lexsort((prices, groups))
+        sorted_prices = prices[order]
+        starts = np.cumsum(counts) - counts
+        positions = starts[:, None] + np.array(PERCENTILES)[None, :] / 100 * (counts[:, None] - 1)
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.ceil(positions).astype(np.int64)
+        self.percentiles = sorted_prices[lower] + (sorted_prices[upper] - sorted_prices[lower]) * (positions - lower)
+        medians = self.percentiles[:, PERCENTILES.index(50)]
+
+        # per-group least squares on centered variables, solved in closed form for all groups
+        def group_sum(values):
+            return np.bincount(groups, weights=values, minlength=n_groups)
+
+        mean_price = group_sum(prices) / counts
+        mean_mileage = group_sum(mileages) / counts
+        mean_accident = group_sum(accidents) / counts
+        d_price = prices - mean_price[groups]
+        d_mileage = mileages - mean_mileage[groups]
+        d_accident = accidents - mean_accident[groups]
+
+        s_mm = group_sum(d_mileage * d_mileage)
+        s_ma = group_sum(d_mileage * d_accident)
+        s_aa = group_sum(d_accident * d_accident)
+        s_mp = group_sum(d_mileage * d_price)
+        s_ap = group_sum(d_accident * d_price)
+
+        # a group without accidents (or without mileage spread) falls back to a single regressor
+        has_mileage = s_mm > 0
+        has_accident = s_aa > 0
+        det = s_mm * s_aa - s_ma * s_ma
+        both = has_mileage & has_accident & (det > 1e-9 * np.maximum(s_mm * s_aa, 1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mileage_slope = np.where(both, (s_aa * s_mp - s_ma * s_ap) / det,
+                                     np.where(has_mileage, s_mp / s_mm, 0.0))
+            accident_slope = np.where(both, (s_mm * s_ap - s_ma * s_mp) / det,
+                                      np.where(has_accident & ~has_mileage, s_ap / s_aa, 0.0))
+
+        fitted = mean_price[groups] + mileage_slope[groups] * d_mileage + accident_slope[groups] * d_accident
+        use_regression = (counts >= MIN_REGRESSION_SIZE)[groups] & (fitted > 0)
+        self.fair_prices = np.where(use_regression, fitted, medians[groups])
+        # a car alone in its group would always match its own price, and a fair price of 0 says nothing
+        self.has_estimate = (counts >= MIN_REGRESSION_SIZE)[groups] & (self.fair_prices > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.deltas = np.where(self.has_estimate, (prices - self.fair_prices) / self.fair_prices, np.nan)
+
+        regression_groups = counts >= MIN_REGRESSION_SIZE
+        self.mileage_slopes = np.where(regression_groups, mileage_slope, 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.accident_discounts = np.where(regression_groups & (mean_price > 0), -accident_slope / mean_price, 0.0)
+
+    def market_delta(self, car_id):
+        """Relative difference between the car's price and its fair price, -0.12 is 12% below market,
+        None when the car's group is too small for an estimate."""
+        i = self.car_index.get(car_id)
+        if i is None or not self.has_estimate[i]:
+            return None
+        return float(self.deltas[i])
+
+    def fair_price(self, car_id):
+        i = self.car_index.get(car_id)
+        if i is None or not self.has_estimate[i]:
+            return None
+        return float(self.fair_prices[i])
+
+    def group_stats(self, mnfctr, model, year):
+        g = self.group_index.get((mnfctr, model, year))
+        if g is None:
+            return None
+        stats = {f'p{q}': float(value) for q, value in zip(PERCENTILES, self.percentiles[g])}
+        stats['count'] = int(self.counts[g])
+        stats['mileage_slope'] = float(self.mileage_slopes[g])
+        stats['accident_discount'] = float(self.accident_discounts[g])
+        return stats
@@ -0,0 +1,74 @@
+import time
+from collections import OrderedDict
+
+
+class SearchSession:
+    """One chat's search results, pinned to the snapshot they were selected from."""
+
+    def __init__(self, snapshot, car_ids):
+        self.snapshot = snapshot
+        self.car_ids = car_ids
+        # index of the car shown last, -1 before the first one
+        self.cursor = -1
+
+    def current(self):
+        if 0 <= self.cursor < len(self.car_ids):
+            return self.car_ids[self.cursor]
+        return None
+
+    def next(self):
+        """Moves to the next car and returns its id, or None when the results are exhausted."""
+        if self.cursor + 1 >= len(self.car_ids):
+            return None
+        self.cursor += 1
+        return self.car_ids[self.cursor]
+
+    def next_short(self):
+        """Moves to the next car still listed and returns its short message, None when the results
+        are exhausted. A listing database may have deleted cars since they were selected."""
+        while self.next() is not None:
+            short_msg = self.snapshot.messages.short(self.current())
+            if short_msg is not None:
+                return short_msg
+        return None
+
+
+class SessionStore:
+    """Search sessions by chat id, evicting the least recently used beyond max_sessions
+    and any session idle for longer than idle_timeout seconds."""
+
+    def __init__(self, max_sessions=10000, idle_timeout=3600):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        # chat id -> (session, last used), least recently used first
+        self.sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def evict(self, now):
+        while self.sessions:
+            _, last_used = next(iter(self.sessions.values()))
+            if len(self.sessions) <= self.max_sessions and now - last_used <= self.idle_timeout:
+                break
+            self.sessions.popitem(last=False)
+
+    def start(self, chat_id, session):
+        now = time.monotonic()
+        self.sessions[chat_id] = (session, now)
+        self.sessions.move_to_end(chat_id)
+        self.evict(now)
+        return session
+
+    def get(self, chat_id):
+        now = time.monotonic()
+        self.evict(now)
+        entry = self.sessions.get(chat_id)
+        if entry is None:
+            return None
+        self.sessions[chat_id] = (entry[0], now)
+        self.sessions.move_to_end(chat_id)
+        return entry[0]
+
+    def end(self, chat_id):
+        self.sessions.pop(chat_id, None)
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+import traceback
+
+# bump when a pickled class changes shape
+SNAPSHOT_FORMAT = 1
+# seconds before a dataset version that failed to load is tried again
+RETRY_INTERVAL = 10
+
+
+def load_cached(source_path, build, version=None, cache_path=None):
+    """Returns build(), reusing a pickle of its result while source_path is unchanged.
+
+    The pickle is stored next to the source as <source_path>.pickle and is only a cache:
+    it is rebuilt when the source, SNAPSHOT_FORMAT or version change, or it cannot be read.
+    """
+    cache_path = cache_path or source_path + '.pickle'
+    stat = os.stat(source_path)
+    key = (SNAPSHOT_FORMAT, version, stat.st_mtime_ns, stat.st_size)
+    try:
+        with open(cache_path, 'rb') as file:
+            if pickle.load(file) == key:
+                return pickle.load(file)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Ignoring unreadable snapshot {cache_path}: {e}")
+
+    value = build()
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(key, file, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        # a read-only deployment still works, it just parses the source every start
+        print(f"Could not write snapshot {cache_path}: {e}")
+    return value
+
+
+def manifest_path(path):
+    return path + '.manifest.json'
+
+
+def dataset_version(path):
+    """Cheap change token of a dataset: the mtime of the manifest the fetcher and processor publish
+    after the file, or of the file itself when it has no manifest."""
+    for candidate in (manifest_path(path), path):
+        try:
+            return os.stat(candidate).st_mtime_ns
+        except FileNotFoundError:
+            pass
+    # not published yet, loading it fails and is retried
+    return None
+
+
+def read_verified(path):
+    """Reads a dataset file, checking it against its manifest when there is one."""
+    with open(path, 'rb') as file:
+        data = file.read()
+    try:
+        with open(manifest_path(path), 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return data
+    if hashlib.sha256(data).hexdigest() != manifest['sha256']:
+        # caught between the file and its manifest being replaced, or damaged
+        raise ValueError(f"{path} does not match its manifest version {manifest['version']}")
+    return data
+
+
+class BackgroundLoader:
+    """Keeps the loaded value of a dataset and reloads it in a background thread when version()
+    changes. get() returns the current value, or None before the first load, and never waits for
+    a reload: the new value replaces the old reference once fully built, so requests in flight
+    keep using the version they started with."""
+
+    def __init__(self, load, name, version=None, retry_interval=RETRY_INTERVAL):
+        # load(version) builds the value of that version
+        self.load = load
+        self.name = name
+        self.version = version or (lambda: None)
+        self.retry_interval = retry_interval
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.thread = None
+        # (version, value) currently served
+        self.loaded = None
+        # (version, monotonic time) of the last failed load
+        self.failed = None
+
+    def start(self):
+        version = self.version()
+        loaded = self.loaded
+        if loaded is not None and loaded[0] == version:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            if self.failed is not None and self.failed[0] == version \
+                    and time.monotonic() - self.failed[1] < self.retry_interval:
+                return
+            self.thread = threading.Thread(target=self.run, args=(version,), name=self.name, daemon=True)
+            self.thread.start()
+
+    def run(self, version):
+        start = time.perf_counter()
+        try:
+            value = self.load(version)
+        except Exception:
+            traceback.print_exc()
+            # keep serving the previous version, a later get() tries again
+            with self.lock:
+                self.failed = (version, time.monotonic())
+                self.thread = None
+            return
+        with self.lock:
+            self.loaded = (version, value)
+            self.failed = None
+            self.thread = None
+        print(f"{self.name} version {version} loaded in {time.perf_counter() - start:.2f}s")
+        self.done.set()
+
+    def get(self, timeout=0):
+        self.start()
+        if self.loaded is None and timeout:
+            self.done.wait(timeout)
+        loaded = self.loaded
+        return loaded[1] if loaded is not None else None
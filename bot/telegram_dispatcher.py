@@ -0,0 +1,239 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+import requests
+from common import metrics
+from common.token_bucket import TokenBucket
+
+# Telegram allows about 30 messages per second overall and 1 per second in a chat, with short bursts
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+MEDIA_GROUP_SIZE = 10
+# seconds to wait for the Bot API, sendMediaGroup has Telegram fetch every photo URL first
+TIMEOUT = 30
+
+
+class TelegramError(Exception):
+    pass
+
+
+class TelegramDispatcher:
+    """Central outbound queue of Bot API calls.
+
+    Every call goes through a global and a per-chat token bucket and is retried after
+    the retry_after of a 429, or with backoff after a connection error or a 5xx. Calls to
+    the same chat are sent one at a time in order, and photos queued back to back for a chat
+    are merged into sendMediaGroup calls of up to 10.
+    Each queued message gets a Future resolving to the sent Telegram message, or failing
+    with TelegramError.
+    """
+
+    def __init__(self, http, token, workers=8, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE,
+                 chat_burst=CHAT_BURST, max_retries=3, max_chats=10000, timeout=TIMEOUT,
+                 backoff_factor=0.5, max_backoff=10):
+        self.http = http
+        self.base_url = f'https://api.telegram.org/bot{token}'
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.timeout = timeout
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        # chat id -> deque of queued items, a chat with items is either in ready_chats or being sent to
+        self.queues = {}
+        # (not before, sequence, chat id), chats wait here for their per-chat bucket without holding a worker
+        self.ready_chats = []
+        self.sequence = itertools.count()
+        self.scheduled_chats = set()
+        # per-chat buckets of recently active chats, least recently used first
+        self.chat_buckets = OrderedDict()
+        self.stats = {'queued': 0, 'sent': 0, 'api_calls': 0, 'coalesced': 0, 'rate_limited': 0, 'failed': 0,
+                      'wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'max_depth': 0}
+
+        self.workers = [threading.Thread(target=self.work, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def enqueue(self, chat_id, items):
+        with self.lock:
+            queue = self.queues.setdefault(chat_id, deque())
+            queue.extend(items)
+            if chat_id not in self.scheduled_chats:
+                self.schedule(chat_id, time.monotonic())
+            self.stats['queued'] += len(items)
+            self.stats['max_depth'] = max(self.stats['max_depth'], self.depth())
+            self.ready.notify()
+        return [item['future'] for item in items]
+
+    def item(self, kind, payload):
+        return {'kind': kind, 'payload': payload, 'future': Future(), 'queued_at': time.monotonic()}
+
+    def send_message(self, chat_id, text, **params):
+        return self.enqueue(chat_id, [self.item('sendMessage', dict(params, chat_id=chat_id, text=text))])[0]
+
+    def send_photos(self, chat_id, photos):
+        """Queues (photo, caption) pairs, photo being a URL or file_id. Returns a Future per photo."""
+        return self.enqueue(chat_id, [self.item('photo', {'media': photo, 'caption': caption})
+                                      for photo, caption in photos])
+
+    def depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def schedule(self, chat_id, not_before):
+        # called with the lock held
+        self.scheduled_chats.add(chat_id)
+        heapq.heappush(self.ready_chats, (not_before, next(self.sequence), chat_id))
+        self.ready.notify()
+
+    def next_batch(self):
+        """Waits for a chat whose bucket allows a call and takes its next call, called with the lock held."""
+        while True:
+            if not self.ready_chats:
+                self.ready.wait()
+                continue
+            not_before, _, chat_id = self.ready_chats[0]
+            now = time.monotonic()
+            if not_before > now:
+                self.ready.wait(not_before - now)
+                continue
+            heapq.heappop(self.ready_chats)
+            wait = self.chat_bucket(chat_id).try_acquire()
+            if wait:
+                heapq.heappush(self.ready_chats, (now + wait, next(self.sequence), chat_id))
+                continue
+            break
+
+        queue = self.queues[chat_id]
+        batch = [queue.popleft()]
+        if batch[0]['kind'] == 'photo':
+            while queue and queue[0]['kind'] == 'photo' and len(batch) < MEDIA_GROUP_SIZE:
+                batch.append(queue.popleft())
+        return chat_id, batch
+
+    def release(self, chat_id):
+        with self.lock:
+            if self.queues[chat_id]:
+                self.schedule(chat_id, time.monotonic())
+            else:
+                del self.queues[chat_id]
+                self.scheduled_chats.discard(chat_id)
+
+    def chat_bucket(self, chat_id):
+        # called with the lock held
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            if len(self.chat_buckets) > self.max_chats:
+                self.chat_buckets.popitem(last=False)
+        self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def work(self):
+        while True:
+            with self.lock:
+                chat_id, batch = self.next_batch()
+            try:
+                self.send_batch(chat_id, batch)
+            finally:
+                self.release(chat_id)
+
+    def send_batch(self, chat_id, batch):
+        if batch[0]['kind'] != 'photo':
+            method, payload = batch[0]['kind'], batch[0]['payload']
+        elif len(batch) == 1:
+            media = batch[0]['payload']
+            method, payload = 'sendPhoto', {'chat_id': chat_id, 'photo': media['media'], 'caption': media['caption']}
+        else:
+            method, payload = 'sendMediaGroup', {
+                'chat_id': chat_id, 'media': [dict(item['payload'], type='photo') for item in batch]}
+
+        now = time.monotonic()
+        with self.lock:
+            for item in batch:
+                wait = now - item['queued_at']
+                metrics.observe('telegram_queue_wait_seconds', wait)
+                self.stats['wait_seconds'] += wait
+                self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], wait)
+            if len(batch) > 1:
+                self.stats['coalesced'] += len(batch) - 1
+
+        try:
+            result = self.call(chat_id, method, payload)
+        except Exception as e:
+            print(f"Telegram {method} to {chat_id} failed: {e}")
+            with self.lock:
+                self.stats['failed'] += len(batch)
+            # callers only have to handle TelegramError to fall back to another way of sending
+            error = e if isinstance(e, TelegramError) else TelegramError(f"{method} failed: {e}")
+            for item in batch:
+                item['future'].set_exception(error)
+            return
+
+        messages = result if isinstance(result, list) else [result]
+        with self.lock:
+            self.stats['sent'] += len(batch)
+        for item, message in zip(batch, messages):
+            item['future'].set_result(message)
+
+    def get_backoff(self, attempt):
+        # full jitter exponential backoff, like data/http_session.py
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+
+    def call(self, chat_id, method, payload):
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            self.global_bucket.acquire()
+            try:
+                with metrics.timer('telegram_request_seconds', method=method):
+                    response = self.http.post(f'{self.base_url}/{method}', json=payload, timeout=self.timeout)
+            except requests.exceptions.ConnectionError as e:
+                metrics.inc('telegram_errors_total', method=method, status='connection')
+                if last_attempt:
+                    raise TelegramError(f"{method} failed: {e}") from e
+                time.sleep(self.get_backoff(attempt))
+                continue
+            except requests.exceptions.RequestException as e:
+                # e.g. a read timeout, Telegram may have sent the message already so it is not sent again
+                metrics.inc('telegram_errors_total', method=method, status=type(e).__name__)
+                raise TelegramError(f"{method} failed: {e}") from e
+            with self.lock:
+                self.stats['api_calls'] += 1
+
+            try:
+                body = response.json()
+            except ValueError:
+                # e.g. the HTML page of a proxy in front of the Bot API
+                body = {'description': response.text[:200]}
+            if body.get('ok'):
+                return body['result']
+            metrics.inc('telegram_errors_total', method=method, status=response.status_code)
+            if response.status_code == 429 and not last_attempt:
+                retry_after = body.get('parameters', {}).get('retry_after', 1)
+                with self.lock:
+                    self.stats['rate_limited'] += 1
+                time.sleep(retry_after)
+                continue
+            if response.status_code >= 500 and not last_attempt:
+                time.sleep(self.get_backoff(attempt))
+                continue
+            raise TelegramError(f"{response.status_code} {body.get('description')}")
+
+    def print_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            depth = self.depth()
+        processed = stats['sent'] + stats['failed']
+        print(f"telegram: {depth} queued now (max {stats['max_depth']}), {stats['sent']} sent in "
+              f"{stats['api_calls']} calls, {stats['coalesced']} coalesced into media groups, "
+              f"{stats['rate_limited']} rate limited, {stats['failed']} failed, queue wait "
+              f"{stats['wait_seconds'] / max(processed, 1):.3f}s avg / {stats['max_wait_seconds']:.3f}s max")
@@ -0,0 +1,85 @@
+import re
+
+# bump when the templates below change, messages stored with another version are rendered again
+TEMPLATE_VERSION = 2
+
+MARKDOWN_SPECIAL = re.compile(r'([_*\[\]()~`>#+\-=|{}.!\\])')
+URL_SPECIAL = re.compile(r'([)\\])')
+# the processor's text for cars without an Encar diagnosis
+NO_DIAGNOSIS = "Информация об официальной диагностике от Encar отсутствует"
+
+
+def escape(value):
+    """Escapes a value for Telegram MarkdownV2 text."""
+    return MARKDOWN_SPECIAL.sub(r'\\\1', str(value))
+
+
+def escape_url(url):
+    # inside (...) of an inline link only ')' and '\' have to be escaped
+    return URL_SPECIAL.sub(r'\\\1', str(url))
+
+
+def render_messages(car_info):
+    """Returns the short and full MarkdownV2 messages of a processed car."""
+    header = (
+        f"*Марка:* {escape(car_info['Manufacturer'])}\n"
+        f"*Модель:* {escape(car_info['Model'])}\n"
+        f"*Год выпуска:* {escape(car_info['Year'])}\n"
+        f"*Пробег:* {escape(car_info['Mileage'])} км\n"
+        f"*Топливо:* {escape(car_info['FuelType'])}\n"
+        f"*Цена:* {escape(car_info['Price'])} ₩\n"
+    )
+    link = f"[Cсылка на автомобиль]({escape_url(car_info['URL'])})\n"
+    # data processed before replacement_parts was added has none
+    if car_info.get('myAccidentCnt', 0) == 0 and not car_info.get('replacement_parts', []):
+        condition = "*Состояние:* Отличное\n"
+    else:
+        condition = "*Состояние:* Присутствуют повреждения\n"
+
+    short_msg = header + condition + link
+    full_msg = (
+        header
+        + f"*Количесто аварий:* {escape(car_info.get('myAccidentCnt', 0))}\n"
+        + f"*Страховая история\\(ущерб нанесённый автомобилю\\):* {escape(car_info.get('myAccidentCost', 0))} ₩\n"
+        + f"*Страховая история\\(ущерб нанесённый другим автомобилям\\):* "
+        + f"{escape(car_info.get('otherAccidentCost', 0))} ₩\n"
+        + f"*Диагностика:* {escape(car_info.get('diagnosis', NO_DIAGNOSIS))}\n"
+        + link
+    )
+    return short_msg, full_msg
+
+
+def render_market_msg(delta):
+    """Describes the price relative to similar cars of the same year."""
+    if delta is None:
+        return ''
+    percent = round(abs(delta) * 100)
+    if percent < 2:
+        return "*Рыночная оценка:* цена соответствует рынку\n"
+    direction = 'ниже' if delta < 0 else 'выше'
+    return f"*Рыночная оценка:* на {percent}% {direction} рынка\n"
+
+
+class MessageCache:
+    """Short and full messages of every car of a snapshot, rendered once and kept as UTF-8 bytes.
+
+    Messages stored by the processor with the current TEMPLATE_VERSION are reused as they are.
+    """
+
+    def __init__(self, cars, analytics):
+        self.version = TEMPLATE_VERSION
+        # car id -> (short message, full message)
+        self.messages = {}
+        for car_id, car_info in cars.items():
+            if car_info.get('template_version') == TEMPLATE_VERSION:
+                short_msg, full_msg = car_info['short_answer_msg'], car_info['full_answer_msg']
+            else:
+                short_msg, full_msg = render_messages(car_info)
+            market_msg = render_market_msg(analytics.market_delta(car_id))
+            self.messages[car_id] = ((short_msg + market_msg).encode(), (full_msg + market_msg).encode())
+
+    def short(self, car_id):
+        return self.messages[car_id][0].decode()
+
+    def full(self, car_id):
+        return self.messages[car_id][1].decode()
@@ -16,4 +16,23 @@ COOKIES = {
     '_ga_BQ7RK9J6BZ': 'GS1.1.1701674727.5.0.1701674727.60.0.0',
     'JSESSIONID': 'Ed7nLfUOndLZUTk8DdwL83BNIATrFpQWx0rfUg0r4qoSRfWRz1pVKm1oatmm8awl.mono-was3-prod_servlet_encarWeb8',
     'WMONID': 'PVTCs0kTuwT'
-}
\ No newline at end of file
+}
+
+# How long cached detail responses are reused before being revalidated, in seconds
+CACHE_TTL = {
+    'profile': 7 * 24 * 3600,
+    'diagnosis': 30 * 24 * 3600,
+    'inspection': 30 * 24 * 3600,
+    'description': 24 * 3600,
+}
+
+# Encar manufacturer -> model groups crawled by main.py --crawl, the models offered by bot/bot_run.py
+CATALOGUE = {
+    '현대': ['그랜저', '아반떼', '쏘나타', '싼타페', '스타렉스', '투싼'],
+    '기아': ['카니발', 'K5', 'K7', '쏘렌토', '레이', '모닝'],
+    '제네시스': ['EQ900', 'G70', 'G80', 'G90', 'GV70', 'GV80', 'GV90'],
+    '쉐보레': ['스파크', '말리부', '트랙스', '크루즈', '올란도', '트레일블레이저'],
+}
+
+# Cars per search request, the largest page the search API serves
+SEARCH_PAGE_SIZE = 100
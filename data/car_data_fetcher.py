@@ -1,20 +1,46 @@
-import os
+import math
+import time
 import requests
 import json
 from typing import Dict
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from common import metrics
+from data.http_session import HttpSession
+from data.response_cache import content_hash
+from data.dataset_publish import publish, temp_path
+from data.record_stream import RecordWriter, is_stream_path
+from data.photo_downloader import PhotoDownloader
+from config.settings import SEARCH_PAGE_SIZE
 
 class CarDataFetcher:
-    def __init__(self, manufacturer,model, year_from, year_to, page_count, download_photos, save_dir, headers, cookies):
+    def __init__(self, manufacturer,model, year_from, year_to, page_count, download_photos, save_dir, headers, cookies,
+                 concurrency=1, session=None, cache=None, deadline=None, page_size=SEARCH_PAGE_SIZE):
         self.manufacturer = manufacturer
         self.model = model
         self.year_from = year_from
         self.year_to = year_to
+        # upper bound on the pages fetched, None fetches every page of the reported total
         self.page_count = page_count
+        self.page_size = page_size
         self.is_download_photos = download_photos
         self.save_dir = save_dir
         self.headers = headers
         self.cookies = cookies
+        self.concurrency = max(1, concurrency)
+        # shared by the listing, detail and photo requests so connections are reused
+        self.session = session or HttpSession(pool_size=self.concurrency)
+        # optional ResponseCache, only new or modified cars get their details refetched
+        self.cache = cache
+        self.photo_downloader = None
+        # time.monotonic() after which no new page is started, the crawl can be resumed later
+        self.deadline = deadline
+        self.stopped = False
+        # set when a page request failed after its retries, the crawl then stops like at the deadline
+        self.failed = False
+        # cars the search reported (capped by page_count) and cars seen on the pages fetched so far
+        self.expected_count = None
+        self.listed_count = 0
 
         # TODO: move these to config.py
         self.base_url = 'https://api.encar.com/search/car/list/general'
@@ -35,43 +61,75 @@ class CarDataFetcher:
     def get_description_api_url(self, car_id):
         return f"https://api.encar.com/v1/readside/vehicle/{car_id}?include=CONTENTS "
     
-    def fetch_from(self, url, headers = None, cookies = None):
+    def fetch_from(self, url, headers = None, cookies = None, endpoint = None):
         try:
-            response = requests.get(url, headers=headers, cookies=cookies)
+            response = self.session.get(url, endpoint=endpoint, headers=headers, cookies=cookies)
             response.raise_for_status()  # Raise an exception for 4xx and 5xx status codes
         except requests.exceptions.RequestException as e:
             print(f"Request failed with exception: {e}")
+            metrics.inc('fetch_failures_total', endpoint=endpoint, reason=type(e).__name__)
             return None
 
-        if response.status_code == 200:
+        # 304 is only possible for conditional requests made by the response cache
+        if response.status_code in (200, 304):
             return response
         else:
             print(f"Request failed with status code {response.status_code}")
+            metrics.inc('fetch_failures_total', endpoint=endpoint, reason=str(response.status_code))
             return None
         
     def fetch_car_data(self, page):
         params = self.create_query_format(page)
         url = f"{self.base_url}?count=true&q={params['q']}&sr={params['sr']}"
 
-        response = self.fetch_from(url, self.headers, self.cookies)
+        response = self.fetch_from(url, self.headers, self.cookies, endpoint='search')
         if response is not None:
             return response.json()
         return response
     
-    def fetch_detailed_data(self, car_id, url):
-        response = self.fetch_from(url, self.headers, self.cookies)
+    def fetch_detailed_data(self, car_id, url, endpoint=None, listing_hash=None):
+        if self.cache is not None:
+            return self.fetch_cached_data(car_id, url, endpoint, listing_hash)
+
+        response = self.fetch_from(url, self.headers, self.cookies, endpoint=endpoint)
         if response is not None:
             return response.json()
         return response
+
+    def fetch_cached_data(self, car_id, url, endpoint, listing_hash):
+        entry = self.cache.get(car_id, endpoint)
+        if self.cache.is_fresh(entry, endpoint, listing_hash):
+            self.cache.count(endpoint, 'hit')
+            return entry['data']
+
+        headers = dict(self.headers, **self.cache.validators(entry))
+        response = self.fetch_from(url, headers, self.cookies, endpoint=endpoint)
+        if response is None:
+            # keep the stale copy rather than losing the details of the car
+            self.cache.count(endpoint, 'miss')
+            return entry['data'] if entry is not None else None
+
+        if response.status_code == 304:
+            self.cache.touch(entry, listing_hash)
+            self.cache.count(endpoint, 'revalidated')
+            return entry['data']
+
+        data = response.json()
+        new_entry = self.cache.put(car_id, endpoint, listing_hash, data,
+                                   response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        if entry is None:
+            self.cache.count(endpoint, 'miss')
+        elif entry['content_hash'] == new_entry['content_hash']:
+            self.cache.count(endpoint, 'unchanged')
+        else:
+            self.cache.count(endpoint, 'modified')
+        return data
     
     def download_photos(self, car_id, photo_urls, save_dir):
-        dir_path = f"{save_dir}/{car_id}"
-        os.makedirs(dir_path, exist_ok=True)
-
-        for i, url in enumerate(photo_urls):
-            response = self.fetch_from(url)
-            if response is not None:
-                self.save_image(response.content, f"{dir_path}/{i}.jpg")
+        # queued on the photo downloader's own pool, finished in print_stats
+        if self.photo_downloader is None:
+            self.photo_downloader = PhotoDownloader(self.session, save_dir, self.concurrency)
+        self.photo_downloader.download_car_photos(car_id, photo_urls)
     
     def prepare_photo_urls(self, single_car_data):
         if not single_car_data or 'Photos' not in single_car_data:
@@ -87,18 +145,17 @@ class CarDataFetcher:
         params = {
             "count": "true",
             "q": f"(And.Hidden.N._.(C.CarType.Y._.(C.Manufacturer.{self.manufacturer}._.ModelGroup.{self.model}.))_.Year.range({self.year_from}..{self.year_to}).)",
-            "sr": f"|PriceAsc|{(page * 10) * 2}|20"
+            "sr": f"|PriceAsc|{page * self.page_size}|{self.page_size}"
         }
         print(params)
         return params
 
-    def save_image(self, image, filename):
-        with open(filename, 'wb') as file:
-            file.write(image)
-
     def save_to_json(self, data, filename):
-        with open(filename, 'w', encoding='utf-8') as file:
+        # written aside and published in one rename, a reader never sees a half written file
+        tmp_filename = temp_path(filename)
+        with open(tmp_filename, 'w', encoding='utf-8') as file:
             json.dump(data, file, ensure_ascii=False, indent=4)
+        publish(tmp_filename, filename, len(data))
 
     def load_json(self, filename):
         with open(filename, 'r', encoding='utf-8') as file:
@@ -123,58 +180,149 @@ class CarDataFetcher:
         with open(md_filename, 'w', encoding='utf-8') as file:
             file.write(md_table)
 
+    def fetch_car_details(self, pool, car):
+        # fan out the detail endpoints of a single car, results are collected later in order
+        id = car['Id']
+        listing_hash = content_hash(car)
+        car['URL'] = self.get_profile_url(id)
+
+        detail_urls = {
+            'profile': self.get_profile_api_url(id),
+            'diagnosis': self.get_diagnosis_api_url(id),
+            'inspection': self.get_inspection_api_url(id),
+            'description': self.get_description_api_url(id),
+        }
+        futures = {key: pool.submit(self.fetch_detailed_data, id, url, key, listing_hash)
+                   for key, url in detail_urls.items()}
+
+        if self.is_download_photos:
+            photo_urls = self.prepare_photo_urls(car)
+            self.download_photos(id, photo_urls, self.save_dir)
+        return futures
+
+    def count_pages(self, raw_data):
+        # the search reports the total number of cars, so only the pages holding them are requested
+        pages = math.ceil(raw_data.get('Count', 0) / self.page_size)
+        if self.page_count is not None:
+            pages = min(pages, self.page_count)
+        return pages
+
+    def iter_car_data(self, start_page=0):
+        """Yields (page, car id, record) in listing order and (page, None, None) after each page."""
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            # the first page tells how many pages follow, these are then all requested at once
+            first_page = pool.submit(self.fetch_car_data, start_page)
+            raw_data = first_page.result()
+            if raw_data is not None:
+                page_count = self.count_pages(raw_data)
+                # pages before start_page were complete when they were checkpointed
+                self.expected_count = min(raw_data.get('Count', 0), page_count * self.page_size)
+                self.listed_count = start_page * self.page_size
+                print(f"{raw_data.get('Count', 0)} cars found, fetching {max(page_count - start_page, 0)} pages "
+                      f"of {self.page_size}")
+            else:
+                page_count = start_page
+            page_futures = [first_page] + [pool.submit(self.fetch_car_data, page)
+                                           for page in range(start_page + 1, page_count)]
+
+            for page, page_future in enumerate(page_futures, start_page):
+                if self.deadline is not None and time.monotonic() > self.deadline:
+                    print(f"Deadline reached, stopping before page {page}.")
+                    self.stopped = True
+                raw_data = None if self.stopped else page_future.result()
+                if raw_data is None and not self.stopped:
+                    print(f"Page {page} failed, stopping.")
+                    self.stopped = self.failed = True
+                car_data = raw_data.get('SearchResults', []) if raw_data is not None else []
+                self.listed_count += len(car_data)
+                if not car_data:
+                    # a failed request or fewer cars than counted, e.g. sold while crawling
+                    if raw_data is not None:
+                        print(f"No data found for page {page}.")
+                    for pending in page_futures[page - start_page:]:
+                        pending.cancel()
+                    break
+
+                page_cars = []
+                for car in car_data:
+                    # Skip if the car is for rent
+                    if car.get('SellType', '') == '렌트':
+                        continue
+
+                    if 'Id' not in car:
+                        print('Car ID not found. Skipping...')
+                        continue
+
+                    page_cars.append((car, self.fetch_car_details(pool, car)))
+
+                # wait for the page in listing order so the output order does not depend on timing
+                for car, futures in page_cars:
+                    yield page, car['Id'], {
+                        'main': car,
+                        'profile': futures['profile'].result(),
+                        'diagnosis': futures['diagnosis'].result(),
+                        'inspection': futures['inspection'].result(),
+                        'description': futures['description'].result()
+                    }
+                yield page, None, None
+
+    def is_complete(self):
+        """True when every page was fetched and together they listed all the cars the search reported."""
+        return not self.stopped and self.expected_count is not None and self.listed_count >= self.expected_count
+
+    def fetch_and_stream_data(self, output_filename):
+        # every car is appended as soon as it is fetched, an interrupted crawl resumes after the last full page
+        query = f"{self.manufacturer}|{self.model}|{self.year_from}|{self.year_to}|{self.page_size}"
+        writer = RecordWriter(output_filename, query)
+        start_page = writer.resume() + 1
+
+        for page, car_id, record in self.iter_car_data(start_page):
+            if car_id is None:
+                writer.checkpoint(page)
+                if self.cache is not None:
+                    # the responses of the page are kept even if the crawl is interrupted later
+                    self.cache.save()
+            else:
+                writer.write(car_id, record)
+
+        if not self.is_complete():
+            # keep the partial file and its checkpoint for the next run, only a full crawl is published
+            if not self.stopped:
+                print(f"Only {self.listed_count} of {self.expected_count} cars were listed.")
+            print(f"Stopped with {writer.count} cars in {writer.part_path}")
+            return None
+        writer.close()
+        print(f"Saved {writer.count} cars to {output_filename}")
+        return writer.count
+
     def fetch_and_save_data(self, output_json_filename, output_md_filename):
+        if is_stream_path(output_json_filename):
+            self.fetch_and_stream_data(output_json_filename)
+            self.print_stats()
+            return
+
         all_car_data = {}
+        for page, car_id, record in self.iter_car_data():
+            if car_id is not None:
+                all_car_data[car_id] = record
+        self.print_stats()
 
-        for page in range(self.page_count):
-            raw_data = self.fetch_car_data(page)
-            if raw_data is None:
-                break
-
-            car_data = raw_data.get('SearchResults', [])
-            if not car_data:
-                print(f"No data found for page {page}.")
-                continue
-
-            for car in car_data:
-                # Skip if the car is for rent
-                if car.get('SellType', '') == '렌트':
-                    continue
-
-                try:
-                    id = car['Id']
-                except KeyError:
-                    print('Car ID not found. Skipping...')
-                    continue
-
-                id = car.get('Id', '')
-                profile_url = self.get_profile_url(id)
-                car['URL'] = profile_url
-
-                profile_api = self.get_profile_api_url(id)
-                diagnosis_api_url = self.get_diagnosis_api_url(id)
-                inspection_api_url = self.get_inspection_api_url(id)
-                description_api_url = self.get_description_api_url(id)
-
-                profile_dict = self.fetch_detailed_data(id, profile_api)
-                diagnosis_dict = self.fetch_detailed_data(id, diagnosis_api_url)
-                inspection_dict = self.fetch_detailed_data(id, inspection_api_url)
-                description_dict = self.fetch_detailed_data(id, description_api_url)
-                
-                all_car_data[id] = {
-                    'main': car,
-                    'profile': profile_dict,
-                    'diagnosis': diagnosis_dict,
-                    'inspection': inspection_dict,
-                    'description': description_dict
-                }
-                
-                if self.is_download_photos:
-                    photo_urls = self.prepare_photo_urls(car)
-                    self.download_photos(id, photo_urls, self.save_dir)
-
-        if all_car_data:
+        if not self.is_complete():
+            print(f"Incomplete crawl, only {self.listed_count} of {self.expected_count} cars listed, not saved.")
+        elif all_car_data:
             self.save_to_json(all_car_data, output_json_filename)
             # self.create_markdown_table(all_car_data, output_md_filename)
         else:
-            print("No data fetched or all data was empty.")
\ No newline at end of file
+            print("No data fetched or all data was empty.")
+
+    def close_photo_downloader(self):
+        if self.photo_downloader is not None:
+            self.photo_downloader.close()
+            self.photo_downloader = None
+
+    def print_stats(self):
+        self.close_photo_downloader()
+        self.session.print_stats()
+        if self.cache is not None:
+            self.cache.save()
+            self.cache.print_stats()
@@ -1,17 +1,32 @@
 import os
 import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from common import metrics
+from common.message_render import TEMPLATE_VERSION, render_messages
+from data.dataset_publish import publish, temp_path
+from data.model_matcher import ModelMatcher
+from data.record_stream import decode_record, is_stream_path, iter_lines, read_records
 
 # (TODO) Move these to utils
+# model years the processor accepts, main.py crawls the same range by default
 YEAR_RANGE_START = 2018
 YEAR_RANGE_END = 2024
-KOR2ENG_MAP = {'현대': 'Hyundai', '기아': 'KIA', '제네시스': 'Genesis', '쉐보레': 'Chevrolet',
-               '그랜저': 'Grandeur', '아반떼': 'Avante', '소나타': 'Sonata', '산타페': 'Santa Fe',
-                '스타렉스': 'Starex', '투싼': 'Tucson', '카니발': 'Carnival', 'K5': 'K5', 'K7': 'K7',
-                '쏘렌토': 'Sorento', '레이': 'Ray', '모닝': 'Morning', 'EQ900': 'EQ900', 'G70': 'G70',
-                'G80': 'G80', 'G90': 'G90', 'GV70': 'GV70', 'GV80': 'GV80', 'GV90': 'GV90',
-                '스파크': 'Spark', '말리부': 'Malibu', '트랙스': 'Trax', '크루즈': 'Cruze',
-                '올란도': 'Orlando', '트레일블레이저': 'Trailblazer',
-                '디젤': 'Дизель', '가솔린': 'Бензин', '가솔린+LPG': 'Бензин и газ', '수동': 'Механика', '자동': 'Автомат'}
+MANUFACTURER_MAP = {'현대': 'Hyundai', '기아': 'KIA', '제네시스': 'Genesis', '쉐보레': 'Chevrolet'}
+MODEL_MAP = {'그랜저': 'Grandeur', '아반떼': 'Avante', '소나타': 'Sonata', '쏘나타': 'Sonata',
+             '산타페': 'Santa Fe', '싼타페': 'Santa Fe', '스타렉스': 'Starex', '투싼': 'Tucson',
+             '카니발': 'Carnival', 'K5': 'K5', 'K7': 'K7', '쏘렌토': 'Sorento', '레이': 'Ray', '모닝': 'Morning',
+             'EQ900': 'EQ900', 'G70': 'G70', 'G80': 'G80', 'G90': 'G90', 'GV70': 'GV70', 'GV80': 'GV80',
+             'GV90': 'GV90', '스파크': 'Spark', '말리부': 'Malibu', '트랙스': 'Trax', '크루즈': 'Cruze',
+             '올란도': 'Orlando', '트레일블레이저': 'Trailblazer',
+             # the Hyundai Genesis sedan, listed under 현대
+             '제네시스': 'Genesis'}
+FUEL_MAP = {'디젤': 'Дизель', '가솔린': 'Бензин', '가솔린+LPG': 'Бензин и газ'}
+TRANSMISSION_MAP = {'수동': 'Механика', '자동': 'Автомат'}
+KOR2ENG_MAP = {**MANUFACTURER_MAP, **MODEL_MAP, **FUEL_MAP, **TRANSMISSION_MAP}
+MODEL_MATCHER = ModelMatcher(MODEL_MAP)
 ENG2RU_MAP = {'FRONT_DOOR_LEFT': 'левая передняя дверь', 'FRONT_DOOR_RIGHT': 'правая передняя дверь',
                 'BACK_DOOR_LEFT': 'левая задняя дверь', 'BACK_DOOR_RIGHT': 'правая задняя дверь',
                 'FRONT_FENDER_LEFT': 'левое переднее крыло', 'FRONT_FENDER_RIGHT': 'правое переднее крыло',
@@ -20,29 +35,65 @@ ENG2RU_MAP = {'FRONT_DOOR_LEFT': 'левая передняя дверь', 'FRON
 
 
 class CarDataProcessor:
-    def __init__(self, data_path):
+    def __init__(self, data_path, workers=1, chunk_size=500, sinks=None):
         self.data_path = data_path
         self.save_path = data_path.split('.')[0] + '_processed.json'
-        self.raw_data = self.load_data(data_path)
-        self.processed_data = {}
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        # extra outputs fed with (car id, processed car) chunks, e.g. ColumnarWriter
+        self.sinks = sinks or []
+        self.collect_records = bool(self.sinks)
+        # seconds spent per processing stage, summed over all workers
+        self.timings = {}
+        # cars that could not be processed, e.g. a year or diagnosis value the parser does not know
+        self.skipped = 0
     
-    def load_data(self, data_path):
-        with open(data_path, 'r') as file:
-            return json.load(file)
-        print(f"Data loaded from {data_path}")
-    def save_data(self, data, save_path):
-        with open(save_path, 'w') as file:
-            json.dump(data, file, ensure_ascii=False, indent=4)
-        print(f"Processed data saved to {save_path}")
+    def __getstate__(self):
+        # sinks stay in the parent process, workers only send the records back
+        state = self.__dict__.copy()
+        state['sinks'] = []
+        return state
+
+    def iter_raw_data(self):
+        # raw data is either the legacy JSON dict or the NDJSON stream written by the fetcher,
+        # both are read one car at a time
+        return read_records(self.data_path)
+
+    def format_record(self, key, value):
+        return f"    {json.dumps(str(key))}: {json.dumps(value, ensure_ascii=False)}"
+
+    def save_lines(self, lines, save_path):
+        # written incrementally as a JSON object with one car per line, to a temporary file
+        # published once complete, so the bots keep reading the previous version until then
+        count = 0
+        tmp_path = temp_path(save_path)
+        try:
+            with open(tmp_path, 'w') as file:
+                file.write('{')
+                for line in lines:
+                    file.write(',\n' if count else '\n')
+                    file.write(line)
+                    count += 1
+                file.write('\n}\n')
+        except BaseException:
+            # the previous version stays published, nothing half written is left behind
+            os.remove(tmp_path)
+            raise
+        manifest = publish(tmp_path, save_path, count)
+        print(f"Processed data of {count} cars saved to {save_path}, version {manifest['version']}")
+        return count
+
+    def save_data(self, records, save_path):
+        return self.save_lines((self.format_record(key, value) for key, value in records), save_path)
     
     def parse_main_data(self, main_dict):
         def parse_car_model(model):
-            # model names are a bit confusing, 
-            # the following trick is used as temporary solution
-            for kor, eng in KOR2ENG_MAP.items():
-                if kor in model:
-                    return eng
-            raise ValueError(f"Model {model} not found in the mapping.")
+            # raw model names carry generation and trim, e.g. '더 뉴 그랜저 IG',
+            # the longest known model name inside them wins
+            eng = MODEL_MATCHER.match(model)
+            if eng is None:
+                raise ValueError(f"Model {model} not found in the mapping.")
+            return eng
         
         def parse_price(price):
             # convert from 만원 to 원
@@ -129,69 +180,158 @@ class CarDataProcessor:
         return res
     
     def construct_asnwer_msg(self, car_info):
-        answer_msg = f"*Марка:* {car_info['Manufacturer']}\n"
-        answer_msg += f"*Модель:* {car_info['Model']}\n"
-        answer_msg += f"*Год выпуска:* {car_info['Year']}\n"
-        answer_msg += f"*Пробег:* {car_info['Mileage']} км\n"
-        answer_msg += f"*Топливо:* {car_info['FuelType']}\n"
-        answer_msg += f"*Цена:* {car_info['Price']} ₩\n"
-        if car_info['myAccidentCnt'] == 0 and not car_info['replacement_parts']:
-            short_answer_msg = answer_msg + f"*Состояние:* Отличное\n"
-        else:
-            short_answer_msg = answer_msg + f"*Состояние:* Присутствуют повреждения\n"
-        answer_msg += f"*Количесто аварий:* {car_info['myAccidentCnt']}\n"
-        answer_msg += f"*Страховая история\(ущерб нанесённый автомобилю\):* {car_info['myAccidentCost']} ₩\n"
-        answer_msg += f"*Страховая история\(ущерб нанесённый другим автомобилям\):* {car_info['otherAccidentCost']} ₩\n"
-        answer_msg += f"*Диагностика:* {car_info['diagnosis']}\n"
-        answer_msg += f"[Cсылка на автомобиль]({car_info['URL']})\n"
-        short_answer_msg += f"[Cсылка на автомобиль]({car_info['URL']})\n"
+        short_answer_msg, full_answer_msg = render_messages(car_info)
         car_info['short_answer_msg'] = short_answer_msg
-        car_info['full_answer_msg'] = answer_msg
+        car_info['full_answer_msg'] = full_answer_msg
+        car_info['template_version'] = TEMPLATE_VERSION
 
-    def process_data(self):
-        for key, value in self.raw_data.items():
-            main_info = value['main']
-            profile = value['profile']
-            diagnosis = value['diagnosis']
-            inspection = value['inspection']
-            description = value['description']
-
-            main_info = self.parse_main_data(main_info)
-            accident = self.parse_profile_data(profile)
-            diagnosis = self.parse_diagnosis_data(diagnosis)
-            inspection = self.parse_inspection_data(inspection)
-            description = self.parse_description_data(description)
-
-            # Merge accident info into main_info
-            main_info.update(accident)
-
-            # Merge diagnosis info into main_info
-            replaced_parts = []
-            if diagnosis:
-                chacker_comment = diagnosis.pop('CHECKER_COMMENT')
-                outer_panel_comment = diagnosis.pop('OUTER_PANEL_COMMENT')
-                for diag_key, diag_value in diagnosis.items():
-                    if diag_value == 'NORMAL':
-                        pass
-                    elif diag_value == 'REPLACEMENT':
-                        replaced_parts.append(ENG2RU_MAP[diag_key])
-                    else:
-                        raise NotImplementedError()
-                if replaced_parts:
-                    d_text = f"Официальная диагностика от Encar показала" \
-                        f" что были заменены следующие детали: {', '.join(replaced_parts)}"
+    def timed(self, timings, stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+        return result
+
+    def process_record(self, value, timings):
+        main_info = value['main']
+        profile = value['profile']
+        diagnosis = value['diagnosis']
+        inspection = value['inspection']
+        description = value['description']
+
+        main_info = self.timed(timings, 'parse_main_data', self.parse_main_data, main_info)
+        accident = self.timed(timings, 'parse_profile_data', self.parse_profile_data, profile)
+        diagnosis = self.timed(timings, 'parse_diagnosis_data', self.parse_diagnosis_data, diagnosis)
+        inspection = self.timed(timings, 'parse_inspection_data', self.parse_inspection_data, inspection)
+        description = self.timed(timings, 'parse_description_data', self.parse_description_data, description)
+
+        # Merge accident info into main_info
+        main_info.update(accident)
+
+        # Merge diagnosis info into main_info
+        replaced_parts = []
+        if diagnosis:
+            chacker_comment = diagnosis.pop('CHECKER_COMMENT')
+            outer_panel_comment = diagnosis.pop('OUTER_PANEL_COMMENT')
+            for diag_key, diag_value in diagnosis.items():
+                if diag_value == 'NORMAL':
+                    pass
+                elif diag_value == 'REPLACEMENT':
+                    replaced_parts.append(ENG2RU_MAP[diag_key])
                 else:
-                    d_text = f"Официальная диагностика от Encar показала" \
-                        " что автомобиль в отличном состоянии, без замененных деталей"
+                    raise NotImplementedError()
+            if replaced_parts:
+                d_text = f"Официальная диагностика от Encar показала" \
+                    f" что были заменены следующие детали: {', '.join(replaced_parts)}"
             else:
-                d_text = "Информация об официальной диагностике от Encar отсутствует"
-            main_info['diagnosis'] = d_text
-            main_info['replacement_parts'] = replaced_parts
+                d_text = f"Официальная диагностика от Encar показала" \
+                    " что автомобиль в отличном состоянии, без замененных деталей"
+        else:
+            d_text = "Информация об официальной диагностике от Encar отсутствует"
+        main_info['diagnosis'] = d_text
+        main_info['replacement_parts'] = replaced_parts
 
-            # TODO: Merge inspection info into main_info
-            # TODO: Merge description info into main_info
+        # TODO: Merge inspection info into main_info
+        # TODO: Merge description info into main_info
 
-            self.construct_asnwer_msg(main_info)
-            self.processed_data[key] = main_info
-        
-        self.save_data(self.processed_data, self.save_path)
\ No newline at end of file
+        self.timed(timings, 'construct_asnwer_msg', self.construct_asnwer_msg, main_info)
+        return main_info
+
+    def process_chunk(self, chunk):
+        # runs in a worker process when workers > 1, timings travel back with the results
+        timings = {}
+        lines = []
+        records = []
+        # (car id, error type, message) of the cars left out, one bad car must not stop the whole run
+        skipped = []
+        for item in chunk:
+            key = None
+            try:
+                if isinstance(item, str):
+                    key, value = self.timed(timings, 'decode', decode_record, item)
+                else:
+                    key, value = item
+                main_info = self.process_record(value, timings)
+                line = self.timed(timings, 'encode', self.format_record, key, main_info)
+            except Exception as e:
+                skipped.append((key, type(e).__name__, str(e)))
+                continue
+            lines.append(line)
+            if self.collect_records:
+                records.append((key, main_info))
+        return lines, records, timings, skipped
+
+    def collect_chunk(self, result):
+        lines, records, timings, skipped = result
+        self.merge_timings(timings)
+        for key, reason, message in skipped:
+            print(f"Skipped car {key}: {reason}: {message}")
+            metrics.inc('processor_skipped_total', reason=reason)
+        self.skipped += len(skipped)
+        for sink in self.sinks:
+            self.timed(self.timings, type(sink).__name__, sink.write_records, records)
+        return lines
+
+    def merge_timings(self, timings):
+        for stage, seconds in timings.items():
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def iter_raw_chunks(self):
+        # NDJSON lines are decoded by process_chunk, i.e. in the workers
+        if is_stream_path(self.data_path):
+            raw_data = iter_lines(self.data_path)
+        else:
+            raw_data = self.iter_raw_data()
+        while True:
+            chunk = list(islice(raw_data, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def iter_processed_lines(self):
+        if self.workers == 1:
+            for chunk in self.iter_raw_chunks():
+                yield from self.collect_chunk(self.process_chunk(chunk))
+            return
+
+        # chunks are submitted with a bounded look-ahead and collected in submission order,
+        # so memory stays flat and the output is identical to a single-process run
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            for chunk in self.iter_raw_chunks():
+                pending.append(pool.submit(self.process_chunk, chunk))
+                if len(pending) < self.workers * 2:
+                    continue
+                yield from self.collect_chunk(pending.popleft().result())
+
+            while pending:
+                yield from self.collect_chunk(pending.popleft().result())
+
+    def print_timings(self, total):
+        print(f"Processing took {total:.2f}s with {self.workers} worker(s)")
+        for stage, seconds in sorted(self.timings.items(), key=lambda item: -item[1]):
+            print(f"  {stage}: {seconds:.2f}s")
+
+    def process_data(self):
+        # read -> parse -> build messages -> write, one chunk at a time so memory stays flat
+        self.timings = {}
+        self.skipped = 0
+        start = time.perf_counter()
+        completed = False
+        try:
+            count = self.save_lines(self.iter_processed_lines(), self.save_path)
+            completed = True
+        finally:
+            # an interrupted run must not finish the sinks as if every car had been written,
+            # the listing database would delete the cars it did not get to
+            for sink in self.sinks:
+                if completed:
+                    self.timed(self.timings, type(sink).__name__, sink.close)
+                else:
+                    sink.abort()
+        if self.skipped:
+            print(f"Skipped {self.skipped} cars that could not be processed")
+        self.print_timings(time.perf_counter() - start)
+        # stages are timed in the workers, so they are reported once their sums are merged
+        metrics.inc('processor_records_total', count)
+        for stage, seconds in self.timings.items():
+            metrics.inc('processor_stage_seconds_total', seconds, stage=stage)
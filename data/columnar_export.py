@@ -0,0 +1,106 @@
+import os
+import shutil
+
+# (column, arrow type) of the exported listings, numbers stay native ints
+COLUMNS = [
+    ('Id', 'string'),
+    ('Manufacturer', 'string'),
+    ('Model', 'string'),
+    ('Year', 'int16'),
+    ('Price', 'int64'),
+    ('Mileage', 'int64'),
+    ('FuelType', 'string'),
+    ('myAccidentCnt', 'int32'),
+    ('otherAccidentCnt', 'int32'),
+    ('myAccidentCost', 'int64'),
+    ('otherAccidentCost', 'int64'),
+    ('URL', 'string'),
+]
+PARTITION_COLUMNS = ['Manufacturer', 'Model', 'Year']
+# positions of the partition columns in a row
+PARTITION_INDEXES = [[name for name, _ in COLUMNS].index(name) for name in PARTITION_COLUMNS]
+FILE_EXTENSIONS = {'parquet': 'parquet', 'ipc': 'arrow'}
+
+
+def to_row(car_id, car_info):
+    return (str(car_id),) + tuple(car_info[name] for name, _ in COLUMNS[1:])
+
+
+class ColumnarWriter:
+    """Writes processed listings as a Parquet or Arrow IPC dataset partitioned by
+    Manufacturer/Model/Year, in batches so memory stays bounded."""
+
+    def __init__(self, out_dir, file_format='parquet', batch_size=50000):
+        try:
+            import pyarrow as pa
+            import pyarrow.compute as pc
+            import pyarrow.dataset as ds
+        except ImportError:
+            raise ImportError("pyarrow is required for the columnar export: pip install pyarrow")
+        if file_format not in FILE_EXTENSIONS:
+            raise ValueError(f"Unknown columnar format {file_format}, expected one of {list(FILE_EXTENSIONS)}")
+
+        self.pa = pa
+        self.pc = pc
+        self.ds = ds
+        self.out_dir = out_dir
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in COLUMNS])
+        self.partitioning = ds.partitioning(
+            pa.schema([self.schema.field(name) for name in PARTITION_COLUMNS]), flavor='hive')
+        self.rows = []
+        self.batches_written = 0
+        self.count = 0
+        # partitions already emptied by this export
+        self.cleared = set()
+
+    def write_records(self, records):
+        self.rows.extend(to_row(car_id, car_info) for car_id, car_info in records)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def partition_dir(self, values):
+        expression = None
+        for name, value in zip(PARTITION_COLUMNS, values):
+            field = self.schema.field(name)
+            condition = self.pc.field(name) == self.pa.scalar(value, type=field.type)
+            expression = condition if expression is None else expression & condition
+        return os.path.join(self.out_dir, self.partitioning.format(expression)[0])
+
+    def clear_partitions(self):
+        # the first batch touching a partition replaces the files a previous export left in it,
+        # partitions this export never writes are kept, e.g. the models of other crawl shards
+        for values in {tuple(row[index] for index in PARTITION_INDEXES) for row in self.rows} - self.cleared:
+            shutil.rmtree(self.partition_dir(values), ignore_errors=True)
+            self.cleared.add(values)
+
+    def flush(self):
+        if not self.rows:
+            return
+        self.clear_partitions()
+        columns = list(zip(*self.rows))
+        table = self.pa.Table.from_arrays(
+            [self.pa.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema)
+        self.ds.write_dataset(
+            table,
+            self.out_dir,
+            format=self.file_format,
+            partitioning=self.partitioning,
+            basename_template=f"part-{self.batches_written}-{{i}}.{FILE_EXTENSIONS[self.file_format]}",
+            existing_data_behavior='overwrite_or_ignore',
+        )
+        self.count += len(self.rows)
+        self.batches_written += 1
+        self.rows = []
+
+    def abort(self):
+        # the batches already written stay, the partitions they replaced are not restored
+        self.rows = []
+        print(f"Columnar {self.file_format} export aborted after {self.count} cars written to "
+              f"{os.path.abspath(self.out_dir)}")
+
+    def close(self):
+        self.flush()
+        print(f"Columnar {self.file_format} dataset of {self.count} cars saved to {os.path.abspath(self.out_dir)}")
@@ -0,0 +1,133 @@
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from data.car_data_fetcher import CarDataFetcher
+from config.settings import SEARCH_PAGE_SIZE
+
+
+def plan_jobs(catalogue, year_from, year_to, years_per_job=None):
+    """Splits every (manufacturer, model) of the catalogue into jobs of at most years_per_job years."""
+    first, last = int(year_from) // 100, int(year_to) // 100
+    step = years_per_job or last - first + 1
+    jobs = []
+    for manufacturer, models in catalogue.items():
+        for model in models:
+            for start in range(first, last + 1, step):
+                end = min(start + step - 1, last)
+                job_from = year_from if start == first else f"{start}00"
+                job_to = year_to if end == last else f"{end}12"
+                jobs.append({
+                    'manufacturer': manufacturer,
+                    'model': model,
+                    'year_from': job_from,
+                    'year_to': job_to,
+                    'key': f"{manufacturer}_{model}_{job_from}_{job_to}",
+                })
+    return jobs
+
+
+class CrawlScheduler:
+    """Crawls a catalogue of (manufacturer, model, year range) jobs concurrently.
+
+    All jobs share one HttpSession, so its connection pool and global rate limit hold for the
+    whole crawl. Jobs never crawled go first, then the ones crawled longest ago, weighted by
+    how many cars the model had last time. No job starts after the deadline and a running job
+    stops after its current page, or at a page that failed, to resume from its checkpoint on the
+    next run. Every job writes its own shard, out_dir/<manufacturer>_<model>_<year_from>_<year_to><suffix>.
+    """
+
+    def __init__(self, session, out_dir, headers, cookies, page_count, jobs=4, concurrency=4, cache=None,
+                 download_photos=False, save_dir=None, deadline=None, suffix='.ndjson', page_size=SEARCH_PAGE_SIZE):
+        self.session = session
+        self.out_dir = out_dir
+        self.headers = headers
+        self.cookies = cookies
+        self.page_count = page_count
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.cache = cache
+        self.download_photos = download_photos
+        self.save_dir = save_dir
+        # seconds the whole crawl may take
+        self.deadline = deadline
+        self.suffix = suffix
+        self.page_size = page_size
+        os.makedirs(out_dir, exist_ok=True)
+
+        # job key -> {'finished_at', 'count', 'seconds'} of its last complete crawl
+        self.state_path = os.path.join(out_dir, 'crawl_state.json')
+        self.state = self.load_state()
+        self.lock = threading.Lock()
+
+    def load_state(self):
+        if not os.path.isfile(self.state_path):
+            return {}
+        with open(self.state_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def save_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.state, file, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.state_path)
+
+    def shard_path(self, job):
+        return os.path.join(self.out_dir, job['key'] + self.suffix)
+
+    def order_jobs(self, jobs):
+        now = time.time()
+        max_count = max((entry['count'] for entry in self.state.values()), default=0)
+
+        def priority(job):
+            last = self.state.get(job['key'])
+            if last is None:
+                return math.inf
+            popularity = last['count'] / max_count if max_count else 0.0
+            return (now - last['finished_at']) * (1 + popularity)
+
+        return sorted(jobs, key=priority, reverse=True)
+
+    def run_job(self, job, deadline):
+        if deadline is not None and time.monotonic() > deadline:
+            return 'skipped'
+
+        fetcher = CarDataFetcher(
+            job['manufacturer'], job['model'], job['year_from'], job['year_to'], self.page_count,
+            self.download_photos, self.save_dir, self.headers, self.cookies,
+            concurrency=self.concurrency, session=self.session, cache=self.cache, deadline=deadline,
+            page_size=self.page_size)
+        start = time.perf_counter()
+        count = fetcher.fetch_and_stream_data(self.shard_path(job))
+        fetcher.close_photo_downloader()
+        # only a verified full crawl updates the job's state, a failed or partial one keeps its last entry
+        if fetcher.failed:
+            return 'failed'
+        if count is None:
+            return 'stopped'
+
+        with self.lock:
+            self.state[job['key']] = {'finished_at': time.time(), 'count': count,
+                                      'seconds': round(time.perf_counter() - start, 2)}
+            self.save_state()
+        return 'completed'
+
+    def run(self, jobs):
+        """Runs the jobs and returns the shard paths of the ones completed."""
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.deadline if self.deadline is not None else None
+        jobs = self.order_jobs(jobs)
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            outcomes = list(pool.map(lambda job: self.run_job(job, deadline), jobs))
+
+        completed = [self.shard_path(job) for job, outcome in zip(jobs, outcomes) if outcome == 'completed']
+        print(f"Crawl of {len(jobs)} jobs took {time.perf_counter() - start:.1f}s: {len(completed)} completed, "
+              f"{outcomes.count('stopped')} stopped, {outcomes.count('failed')} failed, "
+              f"{outcomes.count('skipped')} not started")
+        self.session.print_stats()
+        if self.cache is not None:
+            self.cache.save()
+            self.cache.print_stats()
+        return completed
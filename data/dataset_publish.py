@@ -0,0 +1,49 @@
+import hashlib
+import json
+import os
+import time
+
+
+def manifest_path(path):
+    return path + '.manifest.json'
+
+
+def temp_path(path):
+    # next to the final file, so publishing it is a rename within one filesystem
+    return f"{path}.{os.getpid()}.tmp"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+        # make sure the data is on disk before the rename makes it visible
+        os.fsync(file.fileno())
+    return digest.hexdigest()
+
+
+def write_json_atomic(path, data):
+    tmp_path = temp_path(path)
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+def publish(tmp_path, path, count):
+    """Publishes a fully written tmp_path as path and returns its manifest.
+
+    Readers only ever see the old or the new file. The manifest, <path>.manifest.json, is
+    replaced right after the file and holds the version, record count and sha256 of the file
+    it describes; the bots reload when it changes and refuse a file not matching it.
+    """
+    manifest = {
+        'version': time.time_ns(),
+        'count': count,
+        'sha256': file_sha256(tmp_path),
+        'file': os.path.basename(path),
+        'published_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+    os.replace(tmp_path, path)
+    write_json_atomic(manifest_path(path), manifest)
+    return manifest
@@ -0,0 +1,145 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from common import metrics
+from common.token_bucket import TokenBucket
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'errors': self.errors,
+            'avg_latency': self.total_latency / self.requests if self.requests else 0.0,
+            'max_latency': self.max_latency,
+        }
+
+
+class HttpSession:
+    """Connection-pooled HTTP client with retries, backoff and a global rate limit."""
+
+    def __init__(self, pool_size=10, host_pool_sizes=None, max_retries=3, backoff_factor=0.5,
+                 max_backoff=30.0, rate_limit=None, timeout=30):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.rate_limiter = TokenBucket(rate_limit) if rate_limit else None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # e.g. {'ci.encar.com': 32} to give the photo host its own, bigger pool
+        for host, size in (host_pool_sizes or {}).items():
+            host_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+            self.session.mount(f'http://{host}', host_adapter)
+            self.session.mount(f'https://{host}', host_adapter)
+
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def get_backoff(self, attempt, response=None):
+        # full jitter exponential backoff, Retry-After wins if the server asks for more
+        backoff = random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+        if response is not None:
+            retry_after = self.parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                backoff = max(backoff, min(retry_after, self.max_backoff))
+        return backoff
+
+    @staticmethod
+    def parse_retry_after(value):
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def record(self, endpoint, latency=None, retry=False, error=False):
+        with self._stats_lock:
+            stats = self._stats.setdefault(endpoint, EndpointStats())
+            if latency is not None:
+                metrics.observe('http_request_seconds', latency, endpoint=endpoint)
+                stats.requests += 1
+                stats.total_latency += latency
+                stats.max_latency = max(stats.max_latency, latency)
+            if retry:
+                metrics.inc('http_retries_total', endpoint=endpoint)
+                stats.retries += 1
+            if error:
+                metrics.inc('http_errors_total', endpoint=endpoint)
+                stats.errors += 1
+
+    def get(self, url, endpoint=None, **kwargs):
+        """Sends a GET request, retrying connection errors, 429 and 5xx responses.
+
+        Returns the last response (which may still be an error status) or raises the last
+        requests exception once the retries are exhausted.
+        """
+        endpoint = endpoint or urlparse(url).netloc
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.record(endpoint, time.perf_counter() - start)
+                if attempt == self.max_retries:
+                    self.record(endpoint, error=True)
+                    raise
+                self.record(endpoint, retry=True)
+                time.sleep(self.get_backoff(attempt))
+                continue
+            self.record(endpoint, time.perf_counter() - start)
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                self.record(endpoint, retry=True)
+                backoff = self.get_backoff(attempt, response)
+                response.close()
+                time.sleep(backoff)
+                continue
+
+            if response.status_code >= 400:
+                self.record(endpoint, error=True)
+            elif metrics.registry.enabled and not kwargs.get('stream'):
+                # the body is already read, streamed downloads count their own bytes
+                metrics.inc('http_response_bytes_total', len(response.content), endpoint=endpoint)
+            return response
+
+    def stats(self):
+        with self._stats_lock:
+            return {endpoint: stats.to_dict() for endpoint, stats in self._stats.items()}
+
+    def print_stats(self):
+        for endpoint, stats in sorted(self.stats().items()):
+            print(f"{endpoint}: {stats['requests']} requests, {stats['retries']} retries, "
+                  f"{stats['errors']} errors, avg {stats['avg_latency'] * 1000:.0f} ms, "
+                  f"max {stats['max_latency'] * 1000:.0f} ms")
+
+    def close(self):
+        self.session.close()
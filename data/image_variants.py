@@ -0,0 +1,104 @@
+import hashlib
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# variant name -> longest side in pixels
+VARIANTS = {'thumb': 320, 'medium': 800}
+SOURCE_NAME = re.compile(r'^(\d+)\.jpg$')
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def render_variants(source, variant_dir, variants, quality):
+    """Resizes one photo into every variant, reusing variants cached under the same source hash.
+
+    Runs in a worker process. Returns {variant: cached path} and the number of variants encoded.
+    """
+    from PIL import Image
+
+    source_hash = file_sha256(source)
+    paths = {name: os.path.join(variant_dir, f"{source_hash}_{size}.jpg") for name, size in variants.items()}
+    missing = {name: size for name, size in variants.items() if not os.path.isfile(paths[name])}
+    if missing:
+        with Image.open(source) as image:
+            image = image.convert('RGB')
+            for name, size in missing.items():
+                variant = image.copy()
+                variant.thumbnail((size, size), Image.LANCZOS)
+                tmp_path = f"{paths[name]}.{os.getpid()}.tmp"
+                variant.save(tmp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+                os.replace(tmp_path, paths[name])
+    return paths, len(missing)
+
+
+class ImageVariantGenerator:
+    """Creates resized variants of downloaded photos as save_dir/{car_id}/{i}_{variant}.jpg.
+
+    Variants are encoded in a process pool and cached in save_dir/.variants keyed by source
+    hash and size, so the same image shared by several cars or seen in a later crawl is only
+    encoded once.
+    """
+
+    def __init__(self, save_dir, workers=None, variants=None, quality=80):
+        self.save_dir = save_dir
+        self.variant_dir = os.path.join(save_dir, '.variants')
+        self.workers = workers
+        self.variants = variants or VARIANTS
+        self.quality = quality
+        os.makedirs(self.variant_dir, exist_ok=True)
+
+    def iter_pending_sources(self, car_ids=None):
+        car_ids = car_ids if car_ids is not None else [
+            name for name in os.listdir(self.save_dir) if not name.startswith('.')]
+        for car_id in car_ids:
+            dir_path = os.path.join(self.save_dir, str(car_id))
+            if not os.path.isdir(dir_path):
+                continue
+            for name in os.listdir(dir_path):
+                match = SOURCE_NAME.match(name)
+                if match is None:
+                    continue
+                source = os.path.join(dir_path, name)
+                targets = {variant: os.path.join(dir_path, f"{match.group(1)}_{variant}.jpg")
+                           for variant in self.variants}
+                # up to date when every variant is newer than its source
+                source_mtime = os.path.getmtime(source)
+                if all(os.path.isfile(target) and os.path.getmtime(target) >= source_mtime
+                       for target in targets.values()):
+                    continue
+                yield source, targets
+
+    def link(self, cached, target):
+        tmp_target = f"{target}.tmp"
+        try:
+            os.link(cached, tmp_target)
+        except OSError:
+            shutil.copyfile(cached, tmp_target)
+        os.replace(tmp_target, target)
+        # hard links share the cached file's mtime, mark the variant as fresh for the source
+        os.utime(target)
+
+    def generate(self, car_ids=None):
+        start = time.perf_counter()
+        photos, encoded = 0, 0
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            jobs = [(pool.submit(render_variants, source, self.variant_dir, self.variants, self.quality), targets)
+                    for source, targets in self.iter_pending_sources(car_ids)]
+            for future, targets in jobs:
+                paths, n_encoded = future.result()
+                for variant, target in targets.items():
+                    self.link(paths[variant], target)
+                photos += 1
+                encoded += n_encoded
+
+        print(f"Image variants: {photos} photos updated, {encoded} variants encoded, "
+              f"{photos * len(self.variants) - encoded} reused from cache in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,112 @@
+import json
+import sqlite3
+import time
+
+# (column, SQL type, processed field) of the indexed listing columns, the whole record is kept in data
+COLUMNS = [
+    ('id', 'TEXT PRIMARY KEY', None),
+    ('manufacturer', 'TEXT COLLATE NOCASE', 'Manufacturer'),
+    ('model', 'TEXT COLLATE NOCASE', 'Model'),
+    ('year', 'INTEGER', 'Year'),
+    ('price', 'INTEGER', 'Price'),
+    ('mileage', 'INTEGER', 'Mileage'),
+    ('fuel_type', 'TEXT', 'FuelType'),
+    ('my_accident_cnt', 'INTEGER', 'myAccidentCnt'),
+    ('url', 'TEXT', 'URL'),
+    ('data', 'TEXT', None),
+]
+INDEXES = {
+    'idx_listings_search': '(manufacturer, model, year, price)',
+    'idx_listings_model': '(model)',
+    'idx_listings_price': '(price)',
+    'idx_listings_mileage': '(mileage)',
+}
+
+
+def connect(path):
+    # WAL lets the bots keep reading while a new crawl is written
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.execute(f"CREATE TABLE IF NOT EXISTS listings ({', '.join(f'{name} {sql_type}' for name, sql_type, _ in COLUMNS)})")
+    # the run that last wrote a listing, the ones a newer crawl of their model did not see are deleted
+    if 'run_id' not in [row[1] for row in db.execute('PRAGMA table_info(listings)')]:
+        db.execute('ALTER TABLE listings ADD COLUMN run_id INTEGER')
+    for name, columns in INDEXES.items():
+        db.execute(f'CREATE INDEX IF NOT EXISTS {name} ON listings {columns}')
+    # bumped once a run is written, readers rebuild their price analytics when it changes
+    db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)')
+    db.commit()
+    return db
+
+
+def to_row(car_id, car_info):
+    return ((str(car_id),) + tuple(car_info[field] for _, _, field in COLUMNS[1:-1])
+            + (json.dumps(car_info, ensure_ascii=False),))
+
+
+class ListingDatabase:
+    """Processor sink upserting processed listings into an SQLite database in WAL mode,
+    one transaction per batch of batch_size cars.
+
+    The data processed is taken as a full crawl of its models: on close(), the listings of
+    those models this run did not write, i.e. the cars no longer on Encar, are deleted.
+    years=(first, last) limits this to the years the crawl covered.
+    """
+
+    def __init__(self, path, batch_size=5000, years=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.years = years
+        self.db = connect(path)
+        self.run_id = time.time_ns()
+        # (manufacturer, model) of the listings written by this run
+        self.models = set()
+        names = [name for name, _, _ in COLUMNS] + ['run_id']
+        updates = ', '.join(f'{name} = excluded.{name}' for name in names[1:])
+        self.upsert_sql = (f"INSERT INTO listings ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+                           f"ON CONFLICT(id) DO UPDATE SET {updates}")
+        self.rows = []
+        self.count = 0
+
+    def write_records(self, records):
+        for car_id, car_info in records:
+            self.rows.append(to_row(car_id, car_info) + (self.run_id,))
+            self.models.add((car_info['Manufacturer'], car_info['Model']))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        with self.db:
+            self.db.executemany(self.upsert_sql, self.rows)
+        self.count += len(self.rows)
+        self.rows = []
+
+    def delete_unseen(self):
+        sql = 'DELETE FROM listings WHERE manufacturer = ? AND model = ? AND (run_id IS NULL OR run_id != ?)'
+        extra = ()
+        if self.years is not None:
+            sql += ' AND year BETWEEN ? AND ?'
+            extra = tuple(self.years)
+        deleted = 0
+        for manufacturer, model in sorted(self.models):
+            deleted += self.db.execute(sql, (manufacturer, model, self.run_id) + extra).rowcount
+        return deleted
+
+    def abort(self):
+        """Closes the database after a failed run: the batches already committed are kept, but
+        no listing is deleted and the version readers reload on is not bumped."""
+        self.rows = []
+        self.db.close()
+        print(f"Listing database: run aborted after {self.count} cars upserted into {self.path}")
+
+    def close(self):
+        self.flush()
+        with self.db:
+            deleted = self.delete_unseen()
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (time.time_ns(),))
+        self.db.execute('PRAGMA optimize')
+        self.db.close()
+        print(f"Listing database: {self.count} cars upserted into {self.path}, {deleted} no longer listed deleted")
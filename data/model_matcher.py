@@ -0,0 +1,36 @@
+class ModelMatcher:
+    """Finds the longest known model name inside a raw Encar model string.
+
+    The names are compiled once into a character trie, so a lookup walks the raw string
+    instead of testing every known name, and raw strings already seen are memoized.
+    """
+
+    def __init__(self, names):
+        self.trie = {}
+        for name, value in names.items():
+            node = self.trie
+            for char in name:
+                node = node.setdefault(char, {})
+            # None can never be a character, so it marks the end of a name
+            node[None] = value
+        self.cache = {}
+
+    def match(self, text):
+        """Returns the value of the longest name found in text (leftmost on ties) or None."""
+        if text in self.cache:
+            return self.cache[text]
+
+        best, best_len = None, 0
+        for start, char in enumerate(text):
+            node = self.trie.get(char)
+            end = start + 1
+            while node is not None:
+                if None in node and end - start > best_len:
+                    best, best_len = node[None], end - start
+                if end == len(text):
+                    break
+                node = node.get(text[end])
+                end += 1
+
+        self.cache[text] = best
+        return best
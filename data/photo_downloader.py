@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from common import metrics
+
+
+class PhotoDownloader:
+    """Downloads car photos concurrently into save_dir/{car_id}/{i}.jpg.
+
+    Every image is streamed into a temp file and stored once under save_dir/.blobs by its
+    sha256, then hard-linked into the car directories, so identical photos shared by several
+    cars take disk space once and a URL seen twice is downloaded once. Photos already on disk
+    with the size recorded in the blob index are skipped.
+    """
+
+    def __init__(self, session, save_dir, concurrency=8, chunk_size=64 * 1024):
+        self.session = session
+        self.save_dir = save_dir
+        self.blob_dir = os.path.join(save_dir, '.blobs')
+        self.index_path = os.path.join(self.blob_dir, 'index.json')
+        self.chunk_size = chunk_size
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+        # url -> {'sha256': ..., 'size': ...} of every photo downloaded so far
+        self.index = self.load_index()
+        self.blob_futures = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.futures = []
+        self.stats = {'files': 0, 'downloaded': 0, 'skipped': 0, 'deduplicated': 0, 'failed': 0,
+                      'bytes_downloaded': 0, 'bytes_saved': 0}
+        self.started_at = time.perf_counter()
+
+    def load_index(self):
+        if not os.path.isfile(self.index_path):
+            return {}
+        with open(self.index_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+
+    def save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.index, file)
+        os.replace(tmp_path, self.index_path)
+
+    def count(self, **increments):
+        with self.lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def download_car_photos(self, car_id, photo_urls):
+        dir_path = os.path.join(self.save_dir, str(car_id))
+        os.makedirs(dir_path, exist_ok=True)
+        for i, url in enumerate(photo_urls):
+            self.futures.append(self.pool.submit(self.save_photo, url, os.path.join(dir_path, f"{i}.jpg")))
+
+    def save_photo(self, url, target):
+        self.count(files=1)
+        known = self.index.get(url)
+        if known is not None and os.path.isfile(target) and os.path.getsize(target) == known['size']:
+            self.count(skipped=1, bytes_saved=known['size'])
+            return
+
+        blob = self.get_blob(url)
+        if blob is None:
+            self.count(failed=1)
+            return
+
+        # hard link (or copy) next to the target first, so the rename is atomic
+        tmp_target = f"{target}.{threading.get_ident()}.tmp"
+        try:
+            os.link(blob, tmp_target)
+        except OSError:
+            shutil.copyfile(blob, tmp_target)
+        os.replace(tmp_target, target)
+
+    def get_blob(self, url):
+        with self.lock:
+            future = self.blob_futures.get(url)
+            owner = future is None
+            if owner:
+                future = self.blob_futures[url] = Future()
+
+        if not owner:
+            blob = future.result()
+            if blob is not None:
+                self.count(deduplicated=1, bytes_saved=self.index[url]['size'])
+            return blob
+
+        try:
+            blob = self.download_blob(url)
+        except Exception:
+            future.set_result(None)
+            raise
+        future.set_result(blob)
+        return blob
+
+    def download_blob(self, url):
+        known = self.index.get(url)
+        if known is not None:
+            blob = os.path.join(self.blob_dir, f"{known['sha256']}.jpg")
+            if os.path.isfile(blob):
+                self.count(deduplicated=1, bytes_saved=known['size'])
+                return blob
+
+        try:
+            response = self.session.get(url, endpoint='photo', stream=True)
+        except requests.exceptions.RequestException as e:
+            print(f"Photo request failed with exception: {e}")
+            return None
+
+        with response:
+            if response.status_code != 200:
+                print(f"Photo request failed with status code {response.status_code}")
+                return None
+
+            sha256 = hashlib.sha256()
+            size = 0
+            fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        sha256.update(chunk)
+                        file.write(chunk)
+                        size += len(chunk)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        metrics.inc('http_response_bytes_total', size, endpoint='photo')
+
+        blob = os.path.join(self.blob_dir, f"{sha256.hexdigest()}.jpg")
+        if os.path.isfile(blob):
+            # same image under another URL, keep the existing copy
+            os.remove(tmp_path)
+            self.count(deduplicated=1, bytes_saved=size)
+        else:
+            os.replace(tmp_path, blob)
+        self.count(downloaded=1, bytes_downloaded=size)
+
+        with self.lock:
+            self.index[url] = {'sha256': sha256.hexdigest(), 'size': size}
+        return blob
+
+    def close(self):
+        # wait for the queued photos, surfacing the first unexpected error
+        self.pool.shutdown(wait=True)
+        self.save_index()
+        for future in self.futures:
+            future.result()
+        self.futures = []
+        self.print_stats()
+
+    def print_stats(self):
+        elapsed = time.perf_counter() - self.started_at
+        stats = self.stats
+        print(f"photos: {stats['files']} files, {stats['downloaded']} downloaded, {stats['skipped']} already on disk, "
+              f"{stats['deduplicated']} deduplicated, {stats['failed']} failed")
+        print(f"photos: {stats['bytes_downloaded'] / 1e6:.1f} MB downloaded "
+              f"({stats['bytes_downloaded'] / 1e6 / max(elapsed, 1e-9):.1f} MB/s), "
+              f"{stats['bytes_saved'] / 1e6:.1f} MB saved by skipping and deduplication")
@@ -0,0 +1,182 @@
+import gzip
+import io
+import json
+import os
+from data.dataset_publish import publish
+
+STREAM_SUFFIXES = ('.ndjson', '.ndjson.gz', '.ndjson.zst', '.jsonl', '.jsonl.gz', '.jsonl.zst')
+
+
+def is_stream_path(path):
+    return path.endswith(STREAM_SUFFIXES)
+
+
+def open_text(path, mode, name=None):
+    """Opens a text stream, compressed according to the extension of name (defaults to path)."""
+    name = name or path
+    if name.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if name.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstandard is required for .zst files: pip install zstandard")
+        if mode == 'r':
+            stream = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(open(path, mode + 'b'))
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def iter_json_object(file, chunk_size=1 << 16):
+    """Yields the key/value pairs of a top-level JSON object without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def read_more():
+        nonlocal buffer, pos, eof
+        chunk = file.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def peek():
+        # skips whitespace and returns the next significant character without consuming it
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if eof:
+                raise ValueError("Unexpected end of JSON data")
+            read_more()
+
+    def decode():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # a number cut by the end of the buffer may continue in the next chunk
+                if eof or (end < len(buffer) and buffer[end] not in '0123456789+-.eE'):
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            read_more()
+
+    if peek() != '{':
+        raise ValueError("Expected a JSON object")
+    pos += 1
+    if peek() == '}':
+        return
+
+    while True:
+        key = decode()
+        if peek() != ':':
+            raise ValueError(f"Expected ':' after key {key!r}")
+        pos += 1
+        yield key, decode()
+
+        separator = peek()
+        pos += 1
+        if separator == '}':
+            return
+        if separator != ',':
+            raise ValueError(f"Expected ',' or '}}' after the value of {key!r}")
+
+
+def decode_record(line):
+    record = json.loads(line)
+    return record.pop('id'), record
+
+
+def iter_lines(path):
+    """Yields the raw, still encoded lines of an NDJSON file."""
+    with open_text(path, 'r') as file:
+        for line in file:
+            if line.strip():
+                yield line
+
+
+def read_records(path):
+    """Yields (car id, record) pairs from a raw data file, either NDJSON or the legacy JSON dict."""
+    if not is_stream_path(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            yield from iter_json_object(file)
+        return
+
+    for line in iter_lines(path):
+        yield decode_record(line)
+
+
+class RecordWriter:
+    """Appends one NDJSON record per car and checkpoints after every completed page.
+
+    Records go to `<path>.part` until `close()` publishes the file under its final name, with a
+    manifest, so an interrupted crawl leaves the partial file and `<path>.checkpoint` behind for `resume()`.
+    """
+
+    def __init__(self, path, query=None):
+        self.path = path
+        self.part_path = path + '.part'
+        self.checkpoint_path = path + '.checkpoint'
+        self.query = query
+        self.count = 0
+        self.file = None
+
+    def resume(self):
+        """Returns the last completed page of an interrupted crawl of the same query, or -1."""
+        checkpoint = None
+        if os.path.isfile(self.checkpoint_path) and os.path.isfile(self.part_path):
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as file:
+                checkpoint = json.load(file)
+
+        if checkpoint is None or checkpoint['query'] != self.query:
+            # nothing to resume, start a fresh file
+            open(self.part_path, 'wb').close()
+            return -1
+
+        # drop records of the page that was being written when the crawl stopped
+        with open(self.part_path, 'r+b') as file:
+            file.truncate(checkpoint['offset'])
+        self.count = checkpoint['count']
+        print(f"Resuming after page {checkpoint['page']} with {self.count} cars already saved.")
+        return checkpoint['page']
+
+    def write(self, car_id, record):
+        if self.file is None:
+            self.file = open_text(self.part_path, 'a', name=self.path)
+        self.file.write(json.dumps({'id': car_id, **record}, ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def checkpoint(self, page):
+        # closing ends the compressed frame, so the file can be truncated back to this point
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        checkpoint = {
+            'query': self.query,
+            'page': page,
+            'offset': os.path.getsize(self.part_path),
+            'count': self.count,
+        }
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(checkpoint, file)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        publish(self.part_path, self.path, self.count)
+        if os.path.isfile(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# cars not seen in a listing for this long are dropped from the cache, they are most likely sold
+MAX_AGE = 30 * 24 * 3600
+# writes committed at once, so an interrupted crawl keeps almost all of its responses
+COMMIT_EVERY = 500
+
+
+def content_hash(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """On-disk cache of detail responses keyed by car id and endpoint.
+
+    An entry is reused without a request while the listing it was fetched for is unchanged
+    and the entry is younger than the endpoint TTL. Older entries are revalidated with
+    If-None-Match / If-Modified-Since when the server gave us an ETag or Last-Modified.
+
+    Entries live in SQLite and are only read when a car is looked up, so memory does not grow
+    with the cache. Writes are committed every COMMIT_EVERY changes and on save(), which also
+    drops the cars no listing has shown for max_age seconds.
+    """
+
+    def __init__(self, path, ttl=None, default_ttl=24 * 3600, max_age=MAX_AGE):
+        self.path = path
+        self.ttl = ttl or {}
+        self.default_ttl = default_ttl
+        self.max_age = max_age
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.pending = 0
+        # car ids looked up since the last save, their seen_at is updated in one statement
+        self.seen = set()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses (car_id TEXT, endpoint TEXT, listing_hash TEXT, '
+                        'etag TEXT, last_modified TEXT, content_hash TEXT, fetched_at REAL, seen_at REAL, '
+                        'data TEXT, PRIMARY KEY (car_id, endpoint))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS idx_responses_seen ON responses (seen_at)')
+        self.db.commit()
+
+    def write(self, sql, params):
+        # called with the lock held
+        self.db.execute(sql, params)
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self.db.commit()
+            self.pending = 0
+
+    def save(self):
+        """Commits pending writes and evicts the cars not seen for max_age seconds."""
+        now = time.time()
+        with self.lock:
+            self.db.executemany('UPDATE responses SET seen_at = ? WHERE car_id = ?',
+                                ((now, car_id) for car_id in self.seen))
+            self.seen = set()
+            evicted = self.db.execute('DELETE FROM responses WHERE seen_at < ?', (now - self.max_age,)).rowcount
+            self.db.commit()
+            self.pending = 0
+        if evicted:
+            print(f"cache: evicted {evicted} responses of cars not listed for {self.max_age // 86400} days")
+
+    def count(self, endpoint, outcome):
+        with self.lock:
+            endpoint_stats = self.stats.setdefault(
+                endpoint, {'hit': 0, 'revalidated': 0, 'unchanged': 0, 'modified': 0, 'miss': 0})
+            endpoint_stats[outcome] += 1
+
+    def get(self, car_id, endpoint):
+        car_id = str(car_id)
+        with self.lock:
+            self.seen.add(car_id)
+            row = self.db.execute('SELECT listing_hash, etag, last_modified, content_hash, fetched_at, data '
+                                  'FROM responses WHERE car_id = ? AND endpoint = ?', (car_id, endpoint)).fetchone()
+        if row is None:
+            return None
+        listing_hash, etag, last_modified, data_hash, fetched_at, data = row
+        return {
+            'car_id': car_id,
+            'endpoint': endpoint,
+            'listing_hash': listing_hash,
+            'etag': etag,
+            'last_modified': last_modified,
+            'content_hash': data_hash,
+            'fetched_at': fetched_at,
+            'data': json.loads(data),
+        }
+
+    def is_fresh(self, entry, endpoint, listing_hash):
+        if entry is None or entry['listing_hash'] != listing_hash:
+            return False
+        return time.time() - entry['fetched_at'] < self.ttl.get(endpoint, self.default_ttl)
+
+    def validators(self, entry):
+        """Returns the conditional request headers for a cached entry."""
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, car_id, endpoint, listing_hash, data, etag=None, last_modified=None):
+        now = time.time()
+        entry = {
+            'car_id': str(car_id),
+            'endpoint': endpoint,
+            'listing_hash': listing_hash,
+            'etag': etag,
+            'last_modified': last_modified,
+            'content_hash': content_hash(data),
+            'fetched_at': now,
+            'data': data,
+        }
+        with self.lock:
+            self.write('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (entry['car_id'], endpoint, listing_hash, etag, last_modified, entry['content_hash'],
+                        now, now, json.dumps(data, ensure_ascii=False)))
+        return entry
+
+    def touch(self, entry, listing_hash):
+        entry['listing_hash'] = listing_hash
+        entry['fetched_at'] = time.time()
+        with self.lock:
+            self.write('UPDATE responses SET listing_hash = ?, fetched_at = ? WHERE car_id = ? AND endpoint = ?',
+                       (listing_hash, entry['fetched_at'], entry['car_id'], entry['endpoint']))
+
+    def print_stats(self):
+        for endpoint, endpoint_stats in sorted(self.stats.items()):
+            total = sum(endpoint_stats.values())
+            reused = endpoint_stats['hit'] + endpoint_stats['revalidated']
+            print(f"cache {endpoint}: {reused}/{total} reused ({reused / total:.0%}), "
+                  f"{endpoint_stats['hit']} hits, {endpoint_stats['revalidated']} not modified, "
+                  f"{endpoint_stats['unchanged']} unchanged, {endpoint_stats['modified']} modified, "
+                  f"{endpoint_stats['miss']} misses")
@@ -1,7 +1,15 @@
+import os
 from typing import Dict
+from common import metrics
 from data.car_data_fetcher import CarDataFetcher
-from data.car_data_processor import CarDataProcessor
-from config.settings import HEADERS, COOKIES
+from data.car_data_processor import CarDataProcessor, YEAR_RANGE_END, YEAR_RANGE_START
+from data.columnar_export import ColumnarWriter
+from data.crawl_scheduler import CrawlScheduler, plan_jobs
+from data.image_variants import ImageVariantGenerator
+from data.listing_db import ListingDatabase
+from data.http_session import HttpSession
+from data.response_cache import ResponseCache
+from config.settings import HEADERS, COOKIES, CACHE_TTL, CATALOGUE, SEARCH_PAGE_SIZE
 import argparse
 
 
@@ -9,32 +17,118 @@ def parse_arguments():
     parser = argparse.ArgumentParser(description="Fetch and save car data.")
     parser.add_argument("--manufacturer", type=str, default="현대", help="Manufacturer name")
     parser.add_argument("--model", type=str, default="아반떼", help="Model name")
-    parser.add_argument("--year_from", type=str, default="201253", help="Starting year")
-    parser.add_argument("--year_to", type=str, default="202412", help="Ending year")
-    parser.add_argument("--page_count", type=int, default=20, help="Number of pages to fetch")
+    # by default the years the processor accepts, older or newer cars are skipped when processing
+    parser.add_argument("--year_from", type=str, default=f"{YEAR_RANGE_START}00", help="Starting year (YYYYMM)")
+    parser.add_argument("--year_to", type=str, default=f"{YEAR_RANGE_END}12", help="Ending year (YYYYMM)")
+    parser.add_argument("--page_count", type=int, default=None,
+                        help="Max number of pages to fetch, by default every page of the search total")
+    parser.add_argument("--page_size", type=int, default=SEARCH_PAGE_SIZE, help="Cars per search page")
+    parser.add_argument("--output", type=str, default="data/hyundai.ndjson",
+                        help="Raw data file, .ndjson(.gz|.zst) streams records as they are fetched")
     parser.add_argument("--download_photos", action="store_true", help="Download photos")
     parser.add_argument("--save_dir", type=str, default="car_photos", help="Directory to save photos")
+    parser.add_argument("--make_variants", action="store_true",
+                        help="Create thumb/medium variants of the downloaded photos for the bots")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of parallel requests")
+    parser.add_argument("--rate_limit", type=float, default=10, help="Max requests per second (0 disables)")
+    parser.add_argument("--max_retries", type=int, default=3, help="Retries for failed or throttled requests")
+    parser.add_argument("--incremental", action="store_true", help="Only refetch details of new or modified cars")
+    parser.add_argument("--cache_path", type=str, default="data/response_cache.db", help="Response cache database")
+    parser.add_argument("--process", action="store_true", help="Process the raw data after fetching")
+    parser.add_argument("--skip_fetch", action="store_true", help="Only process an existing raw data file")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used for processing")
+    parser.add_argument("--columnar_dir", type=str, default=None,
+                        help="Also export processed cars as a dataset partitioned by Manufacturer/Model/Year")
+    parser.add_argument("--columnar_format", type=str, default="parquet", choices=["parquet", "ipc"],
+                        help="Format of the columnar export (ipc is the memory-mappable Arrow format)")
+    parser.add_argument("--listing_db", type=str, default=None,
+                        help="Also upsert processed cars into this SQLite listing database for the bots")
+    parser.add_argument("--crawl", action="store_true",
+                        help="Crawl every model of the catalogue into per-model shards instead of a single model")
+    parser.add_argument("--crawl_dir", type=str, default="data/shards", help="Directory of the crawl shards")
+    parser.add_argument("--crawl_jobs", type=int, default=4,
+                        help="Models crawled at the same time, sharing --concurrency connections")
+    parser.add_argument("--years_per_job", type=int, default=None, help="Split every model into year ranges")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="Seconds the crawl may take, unfinished models resume on the next run")
+    parser.add_argument("--metrics", type=str, default=None,
+                        help="Record request and processing metrics and write them to this file in the Prometheus format")
     return parser.parse_args()
 
+def crawl_years(year_from, year_to):
+    # search years are YYYYMM
+    return int(year_from) // 100, int(year_to) // 100
+
 def main():
     args = parse_arguments()
+    metrics.registry.enabled = args.metrics is not None
 
-    car_data_fetcher = CarDataFetcher(
-        args.manufacturer,
-        args.model,
-        args.year_from, 
-        args.year_to, 
-        args.page_count,
-        args.download_photos, 
-        args.save_dir, 
-        HEADERS,
-        COOKIES
+    session = HttpSession(
+        pool_size=args.concurrency,
+        max_retries=args.max_retries,
+        rate_limit=args.rate_limit or None
     )
 
-    car_data_fetcher.fetch_and_save_data('data/hyundai.json', 'data/hyundai.md')
+    cache = ResponseCache(args.cache_path, CACHE_TTL) if args.incremental else None
+
+    if args.crawl:
+        scheduler = CrawlScheduler(
+            session,
+            args.crawl_dir,
+            HEADERS,
+            COOKIES,
+            args.page_count,
+            jobs=args.crawl_jobs,
+            concurrency=max(1, args.concurrency // args.crawl_jobs),
+            cache=cache,
+            download_photos=args.download_photos,
+            save_dir=args.save_dir,
+            deadline=args.deadline,
+            page_size=args.page_size
+        )
+        jobs = plan_jobs(CATALOGUE, args.year_from, args.year_to, args.years_per_job)
+        if args.skip_fetch:
+            data_paths = [path for path in map(scheduler.shard_path, jobs) if os.path.isfile(path)]
+        else:
+            data_paths = scheduler.run(jobs)
+        years = {scheduler.shard_path(job): crawl_years(job['year_from'], job['year_to']) for job in jobs}
+    else:
+        car_data_fetcher = CarDataFetcher(
+            args.manufacturer,
+            args.model,
+            args.year_from, 
+            args.year_to, 
+            args.page_count,
+            args.download_photos, 
+            args.save_dir, 
+            HEADERS,
+            COOKIES,
+            concurrency=args.concurrency,
+            session=session,
+            cache=cache,
+            page_size=args.page_size
+        )
+
+        if not args.skip_fetch:
+            car_data_fetcher.fetch_and_save_data(args.output, 'data/hyundai.md')
+        data_paths = [args.output]
+        years = {args.output: crawl_years(args.year_from, args.year_to)}
+
+    if args.make_variants:
+        ImageVariantGenerator(args.save_dir, workers=args.workers).generate()
+
+    if args.process or args.skip_fetch:
+        for data_path in data_paths:
+            sinks = []
+            if args.columnar_dir:
+                sinks.append(ColumnarWriter(args.columnar_dir, args.columnar_format))
+            if args.listing_db:
+                sinks.append(ListingDatabase(args.listing_db, years=years[data_path]))
+            car_data_processor = CarDataProcessor(data_path, workers=args.workers, sinks=sinks)
+            car_data_processor.process_data()
 
-    # car_data_processor = CarDataProcessor('data/hyundai.json')
-    # car_data_processor.process_data()
+    if args.metrics:
+        metrics.registry.dump(args.metrics)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,72 @@
+import json
+import os
+import pytest
+from data.car_data_processor import CarDataProcessor
+from data.listing_db import ListingDatabase
+
+
+def raw_record(car_id, year=2020, diagnosis_code='NORMAL'):
+    return {
+        'id': car_id,
+        'main': {'Id': car_id, 'Manufacturer': '기아', 'Model': '더 뉴 카니발', 'Price': 3000.0, 'Year': year * 100 + 1.0,
+                 'FuelType': '디젤', 'Mileage': 50000.0, 'URL': f'https://fem.encar.com/cars/detail/{car_id}'},
+        'profile': {'myAccidentCnt': 0, 'otherAccidentCnt': 0, 'myAccidentCost': 0, 'otherAccidentCost': 0},
+        'diagnosis': {'items': [{'name': 'CHECKER_COMMENT', 'result': '', 'resultCode': None},
+                                {'name': 'OUTER_PANEL_COMMENT', 'result': '', 'resultCode': None},
+                                {'name': 'HOOD', 'result': '', 'resultCode': diagnosis_code}]},
+        'inspection': None,
+        'description': None,
+    }
+
+
+def write_raw(path, records):
+    with open(path, 'w', encoding='utf-8') as file:
+        for record in records:
+            file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+RECORDS = [raw_record('1'), raw_record('2', year=2012), raw_record('3', diagnosis_code='CORROSION'),
+           raw_record('4', diagnosis_code='REPLACEMENT'), {'id': '5', 'main': {}}]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_bad_records_are_skipped(tmp_path, workers):
+    raw_path = str(tmp_path / 'raw.ndjson')
+    write_raw(raw_path, RECORDS)
+    listing_db = ListingDatabase(str(tmp_path / 'listings.db'))
+    processor = CarDataProcessor(raw_path, workers=workers, chunk_size=2, sinks=[listing_db])
+    processor.process_data()
+
+    with open(processor.save_path, encoding='utf-8') as file:
+        processed = json.load(file)
+    assert list(processed) == ['1', '4']
+    assert processed['4']['replacement_parts'] == ['капот']
+    assert processor.skipped == 3
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+class FailingSink:
+    def __init__(self):
+        self.aborted = False
+        self.closed = False
+
+    def write_records(self, records):
+        raise OSError("disk full")
+
+    def abort(self):
+        self.aborted = True
+
+    def close(self):
+        self.closed = True
+
+
+def test_failed_run_aborts_sinks_and_keeps_no_temporary_file(tmp_path):
+    raw_path = str(tmp_path / 'raw.ndjson')
+    write_raw(raw_path, [raw_record('1')])
+    sink = FailingSink()
+    processor = CarDataProcessor(raw_path, sinks=[sink])
+    with pytest.raises(OSError):
+        processor.process_data()
+
+    assert sink.aborted and not sink.closed
+    assert os.listdir(tmp_path) == ['raw.ndjson']
@@ -0,0 +1,44 @@
+import pytest
+from car_index import CarKeywordIndex, parse_question
+
+
+@pytest.mark.parametrize('question, manufacturers, models', [
+    # questions about importing cars go to OpenAI and its answer cache
+    ("какая растаможка на машины из Кореи?", set(), set()),
+    ("How do I ship a car to Bishkek?", set(), set()),
+    ("Сколько стоит доставка машины?", set(), set()),
+    ("цены", set(), set()),
+    # everyday words that are also model names
+    ("a ray of light in the morning", set(), set()),
+    ("sonata", set(), set()),
+    # ambiguous models count with a manufacturer or a price question
+    ("sonata price", set(), {'sonata'}),
+    ("hyundai sonata", {'hyundai'}, {'sonata'}),
+    ("цены на киа карнивал", {'kia'}, {'carnival'}),
+    ("Santa Fe price", set(), {'santa fe'}),
+    # unambiguous names always count
+    ("киа к5", {'kia'}, {'k5'}),
+    ("хёндай", {'hyundai'}, set()),
+    ("트레일블레이저 가격", set(), {'trailblazer'}),
+])
+def test_parse_question(question, manufacturers, models):
+    parsed_manufacturers, parsed_models, _ = parse_question(question)
+    assert (parsed_manufacturers, parsed_models) == (manufacturers, models)
+
+
+def test_generic_keyword():
+    assert parse_question("цены на машина")[2]
+    assert not parse_question("hyundai")[2]
+
+
+def make_caption(car):
+    return f"{car['Manufacturer']} {car['Model']}"
+
+
+def test_search_by_model_then_manufacturer():
+    cars = {'1': {'Manufacturer': 'Хендай', 'Model': 'Соната'}, '2': {'Manufacturer': 'Киа', 'Model': 'К5'},
+            '3': {'Manufacturer': 'Hyundai', 'Model': 'Sonata'}, '4': {'Manufacturer': 'Hyundai', 'Model': 'Avante'}}
+    index = CarKeywordIndex(cars, lambda car, attribute: car.get(attribute.capitalize()), make_caption)
+    assert [car_id for car_id, _ in index.search(*parse_question("sonata price")[:2])] == ['1', '3']
+    assert [car_id for car_id, _ in index.search({'hyundai'}, set())] == ['1', '3', '4']
+    assert index.search({'kia'}, set()) == [('2', 'Киа К5')]
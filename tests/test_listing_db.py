@@ -0,0 +1,46 @@
+from data.listing_db import ListingDatabase
+from listing_db import ListingReader, ListingSnapshot
+from search_sessions import SearchSession
+
+
+def car(car_id, price):
+    return car_id, {'Manufacturer': 'KIA', 'Model': 'Carnival', 'Price': price, 'Year': 2020, 'FuelType': 'Дизель',
+                    'Mileage': 50000, 'URL': f'https://fem.encar.com/cars/detail/{car_id}', 'myAccidentCnt': 0,
+                    'otherAccidentCnt': 0, 'myAccidentCost': 0, 'otherAccidentCost': 0}
+
+
+def write(path, cars):
+    database = ListingDatabase(path)
+    database.write_records(cars)
+    database.close()
+
+
+def test_session_skips_cars_deleted_after_the_search(tmp_path):
+    path = str(tmp_path / 'listings.db')
+    write(path, [car('1', 10000000), car('2', 20000000), car('3', 30000000)])
+    snapshot = ListingSnapshot(ListingReader(path), 1)
+    session = SearchSession(snapshot, snapshot.select('KIA', 'Carnival', 2018, 2024))
+    assert session.car_ids == ['1', '2', '3']
+
+    assert 'detail/1' in session.next_short()
+    # a newer crawl of the model no longer lists car 2
+    write(path, [car('1', 10000000), car('3', 30000000)])
+
+    assert snapshot.get('2') is None
+    assert snapshot.messages.short('2') is None
+    assert snapshot.messages.full('2') is None
+    assert 'detail/3' in session.next_short()
+    assert session.current() == '3'
+    assert session.next_short() is None
+
+
+def test_current_car_deleted(tmp_path):
+    path = str(tmp_path / 'listings.db')
+    write(path, [car('1', 10000000), car('2', 20000000)])
+    snapshot = ListingSnapshot(ListingReader(path), 1)
+    session = SearchSession(snapshot, snapshot.select('KIA', 'Carnival', 2018, 2024))
+    session.next_short()
+
+    write(path, [car('2', 20000000)])
+    assert snapshot.messages.full(session.current()) is None
+    assert 'detail/2' in session.next_short()
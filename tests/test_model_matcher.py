@@ -0,0 +1,48 @@
+import pytest
+from data.car_data_processor import MODEL_MAP, MODEL_MATCHER
+from data.model_matcher import ModelMatcher
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('트레일블레이저', 'Trailblazer'),
+    ('더 뉴 트레일블레이저', 'Trailblazer'),
+    ('레이', 'Ray'),
+    ('더 뉴 레이', 'Ray'),
+    ('더 뉴 그랜저 IG', 'Grandeur'),
+    ('쏘나타 DN8', 'Sonata'),
+    ('싼타페 TM', 'Santa Fe'),
+    ('제네시스 EQ900', 'EQ900'),
+    ('제네시스 DH', 'Genesis'),
+    ('GV80', 'GV80'),
+    ('K5 3세대', 'K5'),
+    ('포터2', None),
+    ('', None),
+])
+def test_model_names(raw, expected):
+    assert MODEL_MATCHER.match(raw) == expected
+
+
+def test_longest_match_wins():
+    matcher = ModelMatcher({'레이': 'Ray', '트레일블레이저': 'Trailblazer'})
+    assert matcher.match('트레일블레이저') == 'Trailblazer'
+
+
+def test_leftmost_on_tie():
+    matcher = ModelMatcher({'AB': 'first', 'CD': 'second'})
+    assert matcher.match('xxCDyyAB') == 'second'
+    assert matcher.match('ABCD') == 'first'
+
+
+def test_prefix_of_a_longer_name():
+    # the walk for 'ABCD' passes 'AB' and must still stop at the end of the text
+    matcher = ModelMatcher({'AB': 'short', 'ABCD': 'long'})
+    assert matcher.match('xAB') == 'short'
+    assert matcher.match('xABC') == 'short'
+    assert matcher.match('xABCDx') == 'long'
+
+
+def test_memoized_result_is_the_same():
+    matcher = ModelMatcher(MODEL_MAP)
+    assert matcher.match('더 뉴 레이') == matcher.match('더 뉴 레이') == 'Ray'
+    assert matcher.match('포터2') is matcher.match('포터2') is None
+    assert set(matcher.cache) == {'더 뉴 레이', '포터2'}
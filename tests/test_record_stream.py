@@ -0,0 +1,69 @@
+import io
+import json
+import pytest
+from data.record_stream import iter_json_object, read_records
+
+CHUNK_SIZES = [1, 2, 3, 7, 64, 1 << 16]
+
+CARS = {
+    '38512345': {'main': {'Price': 1290.0, 'Year': 201901.0, 'Mileage': 1e5, 'Model': '더 뉴 그랜저'},
+                 'profile': {'myAccidentCnt': 0, 'myAccidentCost': -12.5e-3},
+                 'diagnosis': {'items': [{'name': 'HOOD', 'resultCode': None}, {'name': 'TRUNK', 'resultCode': 'X'}]},
+                 'description': {'contents': {'text': '무사고 "차량" \\ 입니다 ☃ 🚗'}}},
+    '2': {'empty': {}, 'list': [], 'flags': [True, False, None], 'big': 123456789012345678901234567890},
+    '3': 0,
+    '4': -7,
+    '5': 'plain',
+}
+
+
+def parse(text, chunk_size):
+    return list(iter_json_object(io.StringIO(text), chunk_size=chunk_size))
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+@pytest.mark.parametrize('indent', [None, 4])
+def test_round_trip(chunk_size, indent):
+    text = json.dumps(CARS, ensure_ascii=False, indent=indent)
+    assert parse(text, chunk_size) == list(CARS.items())
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_numbers_split_across_chunks(chunk_size):
+    # every number sits right before the closing brace or a comma, so a chunk may end inside it
+    text = '{"a": 12345678, "b": -0.5e+10, "c": 1E-3, "d": 99}'
+    assert parse(text, chunk_size) == [('a', 12345678), ('b', -0.5e+10), ('c', 1e-3), ('d', 99)]
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+@pytest.mark.parametrize('text', ['{}', '  {  }  ', '\n{\n}\n'])
+def test_empty_object(chunk_size, text):
+    assert parse(text, chunk_size) == []
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+@pytest.mark.parametrize('text', ['', '[1, 2]', '{"a" 1}', '{"a": 1 "b": 2}', '{"a": 1,', '{"a": tru}', '{"a": [1, 2}'])
+def test_invalid_json(chunk_size, text):
+    with pytest.raises(ValueError):
+        parse(text, chunk_size)
+
+
+def test_streams_before_the_end():
+    # the first pair comes out before the broken tail is read
+    pairs = iter_json_object(io.StringIO('{"a": 1, "b": ' + 'x' * 100), chunk_size=4)
+    assert next(pairs) == ('a', 1)
+    with pytest.raises(ValueError):
+        next(pairs)
+
+
+def test_read_records_json_and_ndjson(tmp_path):
+    json_path = tmp_path / 'raw.json'
+    json_path.write_text(json.dumps(CARS, ensure_ascii=False, indent=4), encoding='utf-8')
+    ndjson_path = tmp_path / 'raw.ndjson'
+    ndjson_path.write_text(''.join(json.dumps({'id': car_id, **record}, ensure_ascii=False) + '\n'
+                                   for car_id, record in CARS.items() if isinstance(record, dict)),
+                           encoding='utf-8')
+
+    assert list(read_records(str(json_path))) == list(CARS.items())
+    assert list(read_records(str(ndjson_path))) == [(car_id, record) for car_id, record in CARS.items()
+                                                     if isinstance(record, dict)]
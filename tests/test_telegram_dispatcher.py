@@ -0,0 +1,116 @@
+import threading
+import pytest
+import requests
+from telegram_dispatcher import TelegramDispatcher, TelegramError
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, text=''):
+        self.status_code = status_code
+        self.body = body
+        self.text = text
+
+    def json(self):
+        if self.body is None:
+            raise ValueError("No JSON object could be decoded")
+        return self.body
+
+
+class FakeHttp:
+    """Answers each post with the next scripted response, or raises it if it is an exception,
+    then with a successful result."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def post(self, url, json=None, timeout=None):
+        with self.lock:
+            self.calls.append((url.rsplit('/', 1)[-1], json, timeout))
+            outcome = self.script.pop(0) if self.script else None
+        if isinstance(outcome, Exception):
+            raise outcome
+        if outcome is None:
+            if isinstance(json.get('media'), list):
+                return FakeResponse(200, {'ok': True, 'result': [{'message_id': i} for i in range(len(json['media']))]})
+            return FakeResponse(200, {'ok': True, 'result': {'message_id': 1}})
+        return outcome
+
+
+def make_dispatcher(http, **kwargs):
+    kwargs = dict({'workers': 1, 'chat_rate': 100, 'chat_burst': 100, 'global_rate': 1000, 'backoff_factor': 0},
+                  **kwargs)
+    return TelegramDispatcher(http, 'token', **kwargs)
+
+
+def test_sends_with_a_timeout():
+    http = FakeHttp()
+    dispatcher = make_dispatcher(http, timeout=7)
+    assert dispatcher.send_message(1, 'hi').result(timeout=5) == {'message_id': 1}
+    assert http.calls == [('sendMessage', {'chat_id': 1, 'text': 'hi'}, 7)]
+
+
+def test_retries_after_429():
+    http = FakeHttp(FakeResponse(429, {'ok': False, 'description': 'Too Many Requests',
+                                       'parameters': {'retry_after': 0}}))
+    dispatcher = make_dispatcher(http)
+    assert dispatcher.send_message(1, 'hi').result(timeout=5) == {'message_id': 1}
+    assert len(http.calls) == 2
+    assert dispatcher.stats['rate_limited'] == 1
+
+
+def test_retries_connection_errors_and_5xx():
+    http = FakeHttp(requests.exceptions.ConnectionError('reset'), FakeResponse(502, text='<html>Bad Gateway</html>'),
+                    FakeResponse(500, {'ok': False, 'description': 'Internal Server Error'}))
+    dispatcher = make_dispatcher(http)
+    assert dispatcher.send_message(1, 'hi').result(timeout=5) == {'message_id': 1}
+    assert len(http.calls) == 4
+
+
+def test_photos_are_coalesced_into_media_groups():
+    http = FakeHttp()
+    dispatcher = make_dispatcher(http)
+    futures = dispatcher.send_photos(1, [(f'photo{i}', f'caption{i}') for i in range(12)])
+    assert [future.result(timeout=5)['message_id'] for future in futures] == list(range(10)) + [0, 1]
+
+    method, payload, _ = http.calls[0]
+    assert method == 'sendMediaGroup'
+    assert payload['media'][0] == {'media': 'photo0', 'caption': 'caption0', 'type': 'photo'}
+    assert len(payload['media']) == 10
+    assert [(method, len(payload['media'])) for method, payload, _ in http.calls[1:]] == [('sendMediaGroup', 2)]
+    assert dispatcher.stats['coalesced'] == 10
+
+
+def test_single_photo_is_sent_with_send_photo():
+    http = FakeHttp()
+    dispatcher = make_dispatcher(http)
+    dispatcher.send_photos(1, [('photo', 'caption')])[0].result(timeout=5)
+    assert http.calls == [('sendPhoto', {'chat_id': 1, 'photo': 'photo', 'caption': 'caption'}, 30)]
+
+
+@pytest.mark.parametrize('script', [
+    [FakeResponse(400, {'ok': False, 'description': 'Bad Request: wrong file identifier'})],
+    [requests.exceptions.ConnectionError('reset')] * 4,
+    [FakeResponse(502, text='<html>Bad Gateway</html>')] * 4,
+    [requests.exceptions.ReadTimeout('read timed out')],
+])
+def test_failures_reach_every_future_as_telegram_error(script):
+    http = FakeHttp(*script)
+    dispatcher = make_dispatcher(http, max_retries=3)
+    futures = dispatcher.send_photos(1, [('photo0', 'caption0'), ('photo1', 'caption1')])
+    for future in futures:
+        with pytest.raises(TelegramError):
+            future.result(timeout=5)
+    assert len(http.calls) == len(script)
+    assert dispatcher.stats['failed'] == 2
+
+
+def test_chat_keeps_sending_after_a_failure():
+    http = FakeHttp(FakeResponse(400, {'ok': False, 'description': 'Bad Request'}))
+    dispatcher = make_dispatcher(http)
+    failed = dispatcher.send_message(1, 'first')
+    sent = dispatcher.send_message(1, 'second')
+    with pytest.raises(TelegramError):
+        failed.result(timeout=5)
+    assert sent.result(timeout=5) == {'message_id': 1}
@@ -0,0 +1,20 @@
+from common.token_bucket import TokenBucket
+
+
+def test_burst_then_wait():
+    bucket = TokenBucket(rate=10, capacity=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]
+    wait = bucket.try_acquire()
+    assert 0 < wait <= 0.1
+
+
+def test_default_capacity_is_one_second_of_rate():
+    assert TokenBucket(rate=30).capacity == 30
+    assert TokenBucket(rate=0.5).capacity == 1.0
+
+
+def test_acquire_waits_for_a_token():
+    bucket = TokenBucket(rate=50, capacity=1)
+    bucket.acquire()
+    bucket.acquire()
+    assert bucket.tokens < 1